@@ -4,28 +4,41 @@ and conduct a game of Chexers between them.
 """
 
 import time
+import contextlib
 
 from referee.game import Chexers, IllegalActionException
 from referee.player import PlayerWrapper, ResourceLimitException, set_space_line
 from referee.options import get_options
+from referee.metrics import MetricsWriter
+from referee.record import GameRecorder
+from referee.profiling import Tracer
 
 def main():
     # Parse command-line options into a namespace for use throughout this
     # program
     options = get_options()
+    metrics = recorder = tracer = None
+    if options.metrics is not None:
+        metrics = MetricsWriter(options.metrics)
+    if options.record is not None:
+        recorder = GameRecorder(options.record)
+    if options.trace is not None:
+        tracer = Tracer(options.trace)
 
+    players = []
     try:
         # Import player classes
-        p_R = PlayerWrapper('red',   options.playerR_loc, options)
-        p_G = PlayerWrapper('green', options.playerG_loc, options)
-        p_B = PlayerWrapper('blue',  options.playerB_loc, options)
+        p_R = PlayerWrapper('red',   options.playerR_loc, options, tracer)
+        p_G = PlayerWrapper('green', options.playerG_loc, options, tracer)
+        p_B = PlayerWrapper('blue',  options.playerB_loc, options, tracer)
+        players = [p_R, p_G, p_B]
 
         # We'll start measuring space usage from now, after all
         # library imports should be finished:
         set_space_line()
 
         # Play the game!
-        play(p_R, p_G, p_B, options)
+        play(p_R, p_G, p_B, options, metrics, recorder, tracer)
     
     # In case the game ends in an abnormal way, print a clean error
     # message for the user (rather than a trace).
@@ -39,22 +52,40 @@ def main():
         say("error: resource limit exceeded!")
         if options.verbosity > 0:
             say(e)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        for player in players:
+            player.close()
+        if tracer is not None:
+            tracer.close()
 
-def play(p_R, p_G, p_B, options):
+def play(p_R, p_G, p_B, options, metrics=None, recorder=None, tracer=None):
     # Set up a new Chexers game and initialise a Red, Green and Blue player
     # (constructing three Player classes including running their .__init__() 
     # methods).
-    game = Chexers(options.logfile)
+    game = Chexers(options.logfile, recorder=recorder)
+    try:
+        _play(game, p_R, p_G, p_B, options, metrics, tracer)
+    finally:
+        # (if the game stopped early, this still finishes the log and record)
+        game.close()
+    return game
+
+def _play(game, p_R, p_G, p_B, options, metrics, tracer):
     info("initialising players", options)
     all_players = p_R, p_G, p_B
     for player in all_players:
         # NOTE: `player` here is actually a player wrapper. Your program should 
         # still implement a method called `__init__()`, not one called `init()`.
         player.init()
+        if metrics is not None:
+            metrics.record(game.nturns, player, "init")
 
     # Display the initial state of the game.
     info("game start", options)
-    display(game, options)
+    with span(tracer, "display"):
+        display(game, options)
 
     # Repeat the following until the game ends
     # (starting with Red as the current player, then alternating):
@@ -62,21 +93,8 @@ def play(p_R, p_G, p_B, options):
     result = None
     while not game.over():
         time.sleep(options.delay)
-        info(f"{curr_player.colour} player's turn", options)
-
-        # Ask the current player for their next action (calling their .action() 
-        # method).
-        action = curr_player.action()
-        
-        # Validate this action (or pass) and apply it to the game if it is 
-        # allowed. Display the resulting game state.
-        game.update(curr_player.colour, action)
-        display(game, options)
-
-        # Notify all three players (including the current player) of the action
-        # (or pass) (using their .update() methods).
-        for player in all_players:
-            player.update(curr_player.colour, action)
+        with span(tracer, f"turn {game.nturns + 1}", "turn"):
+            _turn(game, curr_player, all_players, options, metrics, tracer)
 
         # Next player's turn!
         curr_player,next_player,prev_player=next_player,prev_player,curr_player
@@ -87,6 +105,37 @@ def play(p_R, p_G, p_B, options):
     info("game over!", options)
     say(result)
 
+def _turn(game, curr_player, all_players, options, metrics, tracer):
+    info(f"{curr_player.colour} player's turn", options)
+
+    # Ask the current player for their next action (calling their .action() 
+    # method).
+    if metrics is not None:
+        nactions = len(game.moves())
+    action = curr_player.action()
+    if metrics is not None:
+        metrics.record(game.nturns, curr_player, "action", nactions)
+    
+    # Validate this action (or pass) and apply it to the game if it is 
+    # allowed. Display the resulting game state.
+    with span(tracer, "validate & apply"):
+        game.update(curr_player.colour, action)
+    with span(tracer, "display"):
+        display(game, options)
+
+    # Notify all three players (including the current player) of the action
+    # (or pass) (using their .update() methods).
+    for player in all_players:
+        player.update(curr_player.colour, action)
+        if metrics is not None:
+            metrics.record(game.nturns, player, "update")
+
+def span(tracer, name, category="referee"):
+    """A span of the game's trace (if there's a tracer), for a with block"""
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, category)
+
 def display(game, options):
     """Helper function to display the game board (depending on options)"""
     if options.verbosity > 1:
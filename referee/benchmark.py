@@ -0,0 +1,299 @@
+"""
+Benchmarks for the referee's hot paths: micro-benchmarks of Chexers' action
+generation, update, state history and display, of the overhead PlayerWrapper
+adds to each call to a player, and macro-benchmarks of whole games between
+random players. Everything is generated from fixed seeds, so that results
+are comparable between runs (on the same machine).
+
+Run with `python -m referee.benchmark` (see `--help`). Results can be saved
+as JSON (`-o FILE`), and compared against a saved baseline (`--compare
+FILE`), to see whether a change paid off (or slowed anything down).
+"""
+
+import gc
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import contextlib
+
+from referee.game import Chexers, move_to_action
+from referee.player import PlayerWrapper, set_space_line
+
+# positions and games for the micro-benchmarks come from this many random
+# games (from seed 0 on), and full games are played from this many seeds
+_GAMES = 20
+_FULL_GAMES = 5
+# (positions are sampled every this many turns of each game)
+_SAMPLE_EVERY = 8
+# calls to a player per PlayerWrapper benchmark
+_CALLS = 300
+_COLOURS = ["red", "green", "blue"]
+
+
+# Players for the benchmarks
+
+class _NoOpPlayer:
+    """A player doing as little as possible (it only ever passes)."""
+    def __init__(self, colour):
+        pass
+    def action(self):
+        return ("PASS", None)
+    def update(self, colour, action):
+        pass
+
+class _RandomPlayer:
+    """A player choosing its actions at random, from a fixed seed."""
+    seed = 0
+    def __init__(self, colour):
+        self.game = Chexers(None)
+        self.rng = random.Random(f"{self.seed}:{colour}")
+    def action(self):
+        return move_to_action(self.rng.choice(self.game.moves()))
+    def update(self, colour, action):
+        self.game.update(colour, action)
+
+
+# Inputs
+
+def _random_games(n):
+    """The actions of n random games (from seeds 0 to n-1)."""
+    games = []
+    for seed in range(n):
+        rng = random.Random(seed)
+        game = Chexers(None)
+        actions = []
+        while not game.over():
+            action = move_to_action(rng.choice(game.moves()))
+            actions.append(action)
+            game.update(_COLOURS[game.nturns % 3], action)
+        games.append(actions)
+    return games
+
+def _positions(games):
+    """Positions sampled from games (each a Chexers with no history)."""
+    positions = []
+    for actions in games:
+        game = Chexers(None)
+        for i, action in enumerate(actions):
+            if i % _SAMPLE_EVERY == 0:
+                positions.append(Chexers.from_position(game.board.pieces,
+                    game.score, game.nturns))
+            game.update(_COLOURS[game.nturns % 3], action)
+    return positions
+
+def _options(**overrides):
+    """Referee options, as if from the command line (see referee.options)."""
+    options = argparse.Namespace(verbosity=0, time=0, space=0, gc="full",
+        space_sampling=1, isolate=False, ponder="off", delay=0, logfile=None,
+        profile=[], profiler="cprofile", profile_prefix="profile")
+    vars(options).update(overrides)
+    return options
+
+
+# Benchmarks: each takes the inputs and sets up its work, returning the work
+# to time (a function) and how many operations it does (the results are per
+# operation)
+
+def bench_available_actions(inputs):
+    positions = inputs['positions']
+    def work():
+        for game in positions:
+            game._available_actions(game.turn())
+    return work, len(positions)
+
+def bench_moves(inputs):
+    positions = inputs['positions']
+    def work():
+        for game in positions:
+            game.moves()
+    return work, len(positions)
+
+def bench_update(inputs):
+    games = inputs['games']
+    def work():
+        for actions in games:
+            game = Chexers(None)
+            for i, action in enumerate(actions):
+                game.update(_COLOURS[i % 3], action)
+    return work, sum(map(len, games))
+
+def bench_snap(inputs):
+    positions = inputs['positions']
+    def work():
+        for game in positions:
+            game._snap()
+    return work, len(positions)
+
+def _turn_detect_draw_bench(exact_history):
+    """A benchmark of passing a turn in each position (with fresh history)."""
+    def bench(inputs):
+        positions = [Chexers.from_position(game.board.pieces, game.score,
+            game.nturns, exact_history) for game in inputs['positions']]
+        def work():
+            for game in positions:
+                game._turn_detect_draw()
+        return work, len(positions)
+    return bench
+
+def _display_bench(verbosity):
+    """A benchmark of displaying positions at a verbosity level."""
+    from referee.__main__ import display
+    def bench(inputs):
+        positions = inputs['positions']
+        options = _options(verbosity=verbosity)
+        def work():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for game in positions:
+                    display(game, options)
+        return work, len(positions)
+    return bench
+
+def _wrapper_bench(**overrides):
+    """A benchmark of calls to a no-op player through a PlayerWrapper."""
+    def bench(inputs):
+        player = PlayerWrapper("red", (__name__, "_NoOpPlayer"),
+            _options(**overrides))
+        def work():
+            player.init()
+            for _ in range(_CALLS):
+                player.update("red", ("PASS", None))
+            if overrides.get('isolate'):
+                player.player.close()
+        return work, _CALLS
+    return bench
+
+def bench_full_games(inputs):
+    from referee.__main__ import play
+    options = _options()
+    def work():
+        for seed in range(_FULL_GAMES):
+            players = [PlayerWrapper(colour, (__name__, "_RandomPlayer"),
+                options) for colour in _COLOURS]
+            players[0].Player.seed = seed
+            with contextlib.redirect_stdout(io.StringIO()):
+                play(*players, options)
+    return work, _FULL_GAMES
+
+BENCHMARKS = {
+    'available_actions': bench_available_actions,
+    'moves': bench_moves,
+    'update': bench_update,
+    'snap': bench_snap,
+    'turn_detect_draw': _turn_detect_draw_bench(False),
+    'turn_detect_draw_exact': _turn_detect_draw_bench(True),
+    **{f'display_v{v}': _display_bench(v) for v in range(4)},
+    'wrapper_call': _wrapper_bench(),
+    'wrapper_call_gc_young': _wrapper_bench(gc="young", space_sampling=16),
+    'wrapper_call_isolated': _wrapper_bench(isolate=True),
+    'full_games': bench_full_games,
+}
+
+
+def run(names, repeat=5, progress=None):
+    """
+    Run the named benchmarks, each `repeat` times, and return the results:
+    for each benchmark, the number of operations per run and the best
+    (least) time per operation, in microseconds.
+    """
+    games = _random_games(_GAMES)
+    inputs = {'games': games, 'positions': _positions(games)}
+    # (keep the inputs out of the way of the garbage collector, which the
+    # referee runs around each call to a player)
+    gc.collect()
+    gc.freeze()
+    results = {}
+    for name in names:
+        best = float('inf')
+        for _ in range(repeat):
+            work, ops = BENCHMARKS[name](inputs)
+            start = time.perf_counter()
+            work()
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'ops': ops, 'us_per_op': best / ops * 1e6}
+        if progress is not None:
+            progress(name, results[name])
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline (both from run), generating a line
+    for each benchmark in both. Return the names of the benchmarks more
+    than `tolerance` (a fraction) slower than the baseline.
+    """
+    slower = []
+    lines = [f"{'benchmark':24s} {'baseline':>12s} {'current':>12s} "
+        f"{'change':>8s}"]
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['us_per_op'], result['us_per_op']
+        change = after / before - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  (slower)"
+            slower.append(name)
+        elif change < -tolerance:
+            flag = "  (faster)"
+        lines.append(f"{name:24s} {before:10.3f}us {after:10.3f}us "
+            f"{change:+7.1%}{flag}")
+    return lines, slower
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m referee.benchmark",
+        description="Benchmark the referee's hot paths.")
+    parser.add_argument('-k', '--select', metavar="NAME", action='append',
+        help="run only the benchmarks whose names contain NAME (may be "
+            f"repeated; choose from: {', '.join(BENCHMARKS)})")
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help="run each benchmark this many times, keeping the best "
+            "(default: %(default)s)")
+    parser.add_argument('-o', '--output', metavar="FILE",
+        help="save the results as JSON to FILE")
+    parser.add_argument('-c', '--compare', metavar="FILE",
+        help="compare the results with a baseline saved (with -o) to FILE, "
+            "exiting with status 1 if any benchmark got slower")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+        help="with --compare, the fraction by which a benchmark can be "
+            "slower than the baseline before it counts (default: "
+            "%(default)s)")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.select
+        or any(s in name for s in args.select)]
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    set_space_line()
+    def progress(name, result):
+        print(f"{name:24s} {result['us_per_op']:10.3f}us per op "
+            f"({result['ops']} ops)", flush=True)
+    results = run(names, args.repeat, progress)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent=2)
+    if baseline is not None:
+        lines, slower = compare(results, baseline, args.tolerance)
+        print()
+        for line in lines:
+            print(line)
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Provide a compact bitboard representation of the Chexers board, along with
+precomputed neighbour and jump tables for fast, bit-parallel generation of
+actions.
+
+Cells are numbered from 0 to 36 in the same order the referee displays them
+(by q, then by r), and a set of cells is represented as an int with bit n
+set if cell n is in the set. The board state is then just one such mask for
+each colour, plus a mask of all occupied cells.
+"""
+
+import random
+
+# Game-specific constants:
+
+STARTING_HEXES = {
+    'r': {(-3,3), (-3,2), (-3,1), (-3,0)},
+    'g': {(0,-3), (1,-3), (2,-3), (3,-3)},
+    'b': {(3, 0), (2, 1), (1, 2), (0, 3)},
+}
+FINISHING_HEXES = {
+    'r': {(3,-3), (3,-2), (3,-1), (3,0)},
+    'g': {(-3,3), (-2,3), (-1,3), (0,3)},
+    'b': {(-3,0),(-2,-1),(-1,-2),(0,-3)},
+}
+ADJACENT_STEPS = [(-1,+0),(+0,-1),(+1,-1),(+1,+0),(+0,+1),(-1,+1)]
+
+
+# Cell numbering:
+
+_RAN = range(-3, +3+1)
+CELLS = [(q,r) for q in _RAN for r in _RAN if -q-r in _RAN]
+CELL_INDEX = {qr: n for n, qr in enumerate(CELLS)}
+N_CELLS = len(CELLS)
+ALL_CELLS = (1 << N_CELLS) - 1
+
+
+def _mask(hexes):
+    """Convert an iterable of (q, r) hexes into a cell mask."""
+    mask = 0
+    for qr in hexes:
+        mask |= 1 << CELL_INDEX[qr]
+    return mask
+
+START_MASKS  = {col: _mask(hexes) for col, hexes in STARTING_HEXES.items()}
+FINISH_MASKS = {col: _mask(hexes) for col, hexes in FINISHING_HEXES.items()}
+
+
+# Neighbour and jump tables, indexed by cell number (-1 for 'off the board'):
+
+def _step(n, step, i):
+    (q, r), (dq, dr) = CELLS[n], step
+    return CELL_INDEX.get((q+dq*i, r+dr*i), -1)
+
+NEIGHBOURS = [tuple(_step(n, step, 1) for step in ADJACENT_STEPS)
+    for n in range(N_CELLS)]
+JUMPS      = [tuple(_step(n, step, 2) for step in ADJACENT_STEPS)
+    for n in range(N_CELLS)]
+NEIGHBOUR_MASKS = [_mask(CELLS[m] for m in NEIGHBOURS[n] if m >= 0)
+    for n in range(N_CELLS)]
+
+# the cell jumped over by a jump from cell a to cell b is at JUMPED[a][b]
+JUMPED = [[-1] * N_CELLS for _ in range(N_CELLS)]
+for _a in range(N_CELLS):
+    for _c, _b in zip(NEIGHBOURS[_a], JUMPS[_a]):
+        if _b >= 0:
+            JUMPED[_a][_b] = _c
+del _a, _b, _c
+
+
+# Shift groups for bit-parallel action generation:
+# Because the rows of the hexagon have different lengths, the difference in
+# cell number between a cell and its neighbour in a given direction is not the
+# same everywhere. However, it only takes a few values, so for each direction
+# we group the cells by that difference. Within one group, a single shift moves
+# the whole group one step in that direction at once.
+
+def _step_groups():
+    """(mask, delta) groups for a step to the neighbour in each direction."""
+    groups = []
+    for d in range(len(ADJACENT_STEPS)):
+        by_delta = {}
+        for n in range(N_CELLS):
+            m = NEIGHBOURS[n][d]
+            if m >= 0:
+                by_delta[m-n] = by_delta.get(m-n, 0) | (1 << n)
+        groups.append(tuple((mask, delta) for delta,mask in by_delta.items()))
+    return groups
+def _jump_groups():
+    """(mask, over, land) groups for a jump in each direction."""
+    groups = []
+    for d in range(len(ADJACENT_STEPS)):
+        by_delta = {}
+        for n in range(N_CELLS):
+            c, b = NEIGHBOURS[n][d], JUMPS[n][d]
+            if b >= 0:
+                key = (c-n, b-n)
+                by_delta[key] = by_delta.get(key, 0) | (1 << n)
+        groups.append(tuple((mask, over, land)
+            for (over, land), mask in by_delta.items()))
+    return groups
+
+_STEP_GROUPS = _step_groups()
+_JUMP_GROUPS = _jump_groups()
+
+
+# Zobrist keys for hashing positions:
+# One random 64-bit key for each (colour, cell) pair and one for each value of
+# the turn counter modulo 3 (whose turn it is); a position's hash is the XOR of
+# the keys of its pieces and its turn. The keys come from a fixed seed so that
+# hashes agree between processes and runs (e.g. for files keyed by hash).
+
+_ZOBRIST_SEED = 0xC4E8E125
+_rng = random.Random(_ZOBRIST_SEED)
+ZOBRIST = {colour: [_rng.getrandbits(64) for _ in range(N_CELLS)]
+    for colour in "rgb"}
+ZOBRIST_TURN = [_rng.getrandbits(64) for _ in range(3)]
+del _rng
+
+def zobrist_hash(pieces, turn):
+    """
+    Compute (from scratch) the Zobrist hash of the position with these
+    colour masks, when it is turn number `turn` (modulo 3).
+    """
+    h = ZOBRIST_TURN[turn % 3]
+    for colour, mask in pieces.items():
+        keys = ZOBRIST[colour]
+        for n in cells_of(mask):
+            h ^= keys[n]
+    return h
+
+
+def _shift(mask, delta):
+    """Shift a cell mask so that bit n moves to bit n+delta."""
+    return mask << delta if delta >= 0 else mask >> -delta
+
+def cells_of(mask):
+    """Generate the cell numbers in a mask, in increasing order."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Bitboard:
+    """
+    Represent the pieces on a Chexers board as one cell mask per colour plus
+    an occupancy mask. Main useful methods are the generators (`moves`,
+    `jumps`, `exits`, `actions`) and the modifiers (`move`, `jump`, `exit`).
+    """
+    __slots__ = ("pieces", "occupied")
+
+    def __init__(self, pieces=None):
+        if pieces is None:
+            pieces = START_MASKS
+        self.pieces = dict(pieces)
+        self.occupied = self.pieces['r'] | self.pieces['g'] | self.pieces['b']
+
+    def colour_at(self, n):
+        """The colour of the piece on cell n ('r', 'g' or 'b'), or ' '."""
+        bit = 1 << n
+        if self.occupied & bit:
+            for colour, mask in self.pieces.items():
+                if mask & bit:
+                    return colour
+        return ' '
+    def __getitem__(self, qr):
+        return self.colour_at(CELL_INDEX[qr])
+
+    # action generation:
+
+    def moves(self, colour):
+        """A list of (a, b) cell pairs for this colour's available moves."""
+        pieces = self.pieces[colour]
+        empty  = ALL_CELLS ^ self.occupied
+        moves = []
+        for groups in _STEP_GROUPS:
+            for mask, delta in groups:
+                for a in cells_of(pieces & mask & _shift(empty, -delta)):
+                    moves.append((a, a+delta))
+        return moves
+    def jumps(self, colour):
+        """A list of (a, b) cell pairs for this colour's available jumps."""
+        pieces = self.pieces[colour]
+        occupied = self.occupied
+        empty = ALL_CELLS ^ occupied
+        jumps = []
+        for groups in _JUMP_GROUPS:
+            for mask, over, land in groups:
+                sources = (pieces & mask & _shift(occupied, -over)
+                    & _shift(empty, -land))
+                for a in cells_of(sources):
+                    jumps.append((a, a+land))
+        return jumps
+    def exits(self, colour):
+        """A list of cells from which this colour's pieces can exit."""
+        return list(cells_of(self.pieces[colour] & FINISH_MASKS[colour]))
+
+    def has_actions(self, colour):
+        """True iff this colour has at least one action other than passing."""
+        pieces = self.pieces[colour]
+        if pieces & FINISH_MASKS[colour]:
+            return True
+        occupied = self.occupied
+        empty = ALL_CELLS ^ occupied
+        for groups in _STEP_GROUPS:
+            for mask, delta in groups:
+                if pieces & mask & _shift(empty, -delta):
+                    return True
+        for groups in _JUMP_GROUPS:
+            for mask, over, land in groups:
+                if (pieces & mask & _shift(occupied, -over)
+                        & _shift(empty, -land)):
+                    return True
+        return False
+
+    def actions(self, colour):
+        """
+        A list of currently-available actions for a particular colour, in
+        the (atype, aargs) format used by players and the referee.
+        """
+        actions = [("EXIT", CELLS[a]) for a in self.exits(colour)]
+        actions += [("MOVE", (CELLS[a], CELLS[b])) for a,b in self.moves(colour)]
+        actions += [("JUMP", (CELLS[a], CELLS[b])) for a,b in self.jumps(colour)]
+        if not actions:
+            actions.append(("PASS", None))
+        return actions
+
+    # validation of a single action, in constant time:
+
+    def is_move(self, colour, a, b):
+        """True iff this colour can move a piece from cell a to cell b."""
+        return bool(self.pieces[colour] & (1 << a) and NEIGHBOUR_MASKS[a]
+            & (1 << b) & ~self.occupied)
+    def is_jump(self, colour, a, b):
+        """True iff this colour can jump a piece from cell a to cell b."""
+        c = JUMPED[a][b]
+        return bool(c >= 0 and self.pieces[colour] & (1 << a)
+            and self.occupied & (1 << c) and not self.occupied & (1 << b))
+    def is_exit(self, colour, a):
+        """True iff this colour can exit a piece from cell a."""
+        return bool(self.pieces[colour] & FINISH_MASKS[colour] & (1 << a))
+
+    # action application (these methods do not check legality):
+
+    def move(self, colour, a, b):
+        """Move a piece of this colour from cell a to cell b."""
+        ab = (1 << a) | (1 << b)
+        self.pieces[colour] ^= ab
+        self.occupied ^= ab
+    def jump(self, colour, a, b):
+        """
+        Jump a piece of this colour from cell a to cell b, converting the
+        jumped-over piece. Return the colour the jumped-over piece had.
+        """
+        self.move(colour, a, b)
+        c = JUMPED[a][b]
+        over = self.colour_at(c)
+        if over != colour:
+            bit = 1 << c
+            self.pieces[over] ^= bit
+            self.pieces[colour] |= bit
+        return over
+    def exit(self, colour, a):
+        """Remove a piece of this colour from cell a (off the board)."""
+        bit = 1 << a
+        self.pieces[colour] ^= bit
+        self.occupied ^= bit
+
+    # the inverses of exit and of a jump's conversion (for undoing actions):
+
+    def enter(self, colour, a):
+        """Put a piece of this colour (back) onto (empty) cell a."""
+        bit = 1 << a
+        self.pieces[colour] |= bit
+        self.occupied |= bit
+    def convert(self, colour, c):
+        """Convert the (occupied) cell c to this colour."""
+        bit = 1 << c
+        for other in self.pieces:
+            self.pieces[other] &= ~bit
+        self.pieces[colour] |= bit
@@ -0,0 +1,572 @@
+"""
+Differential fuzzing of a Chexers engine (by default, the referee's own
+referee.game.Chexers) against a reference engine: the referee's original,
+dict-based implementation of the rules (see ReferenceChexers), which is slow
+but simple enough to trust.
+
+Each game is a sequence of actions generated from a seed, mostly legal
+actions chosen by one of a few policies (random, or repeating positions, or
+racing to exit), with some illegal or malformed actions mixed in. Both
+engines play through the sequence, and after every action they must agree
+on the legal actions, on accepting or rejecting the action, on the board,
+scores, turn count, draw detection and repetition count, and on the result.
+If the engine has a search API (moves, make_move and unmake_move), its moves
+must match its legal actions, and making then unmaking each move must
+restore the state exactly.
+
+The batch simulator (referee.batch) can be checked the same way, through an
+adapter playing one lane of it (see BatchLane). By default, both the
+referee's Chexers and the batch simulator (if NumPy is installed) are
+checked, on the same games.
+
+A game where the engines disagree is shrunk to a short sequence of actions
+that still shows a disagreement, and reported (with its seed).
+
+Run with `python -m referee.fuzz` (see `--help`).
+"""
+
+import sys
+import time
+import random
+import inspect
+import argparse
+import functools
+import importlib
+import multiprocessing
+from collections import defaultdict
+
+from referee.board import CELLS, STARTING_HEXES, FINISHING_HEXES
+from referee.board import ADJACENT_STEPS
+from referee.game import IllegalActionException, move_to_action
+from referee.batch import BatchSimulator, DRAW_MESSAGES, PASS_SLOT
+from referee.batch import slot_to_action
+
+_COLOURS = ["red", "green", "blue"]
+_COL_NAME = {'r': "Red", 'g': "Green", 'b': "Blue"}
+_MAX_TURNS = 256 # per player
+
+
+class ReferenceChexers:
+    """
+    The rules of Chexers as the referee first implemented them (without the
+    log or display), with the board as a dict from (q, r) hexes to colours
+    ('r', 'g' or 'b', or ' ' for empty), the state history keyed by exact
+    states, and legal actions found by trying every step from every hex.
+    """
+    def __init__(self):
+        ran = range(-3, +3+1)
+        self.hexes = {(q,r) for q in ran for r in ran if -q-r in ran}
+        self.board = {qr: ' ' for qr in self.hexes}
+        for colour in "rgb":
+            for qr in STARTING_HEXES[colour]:
+                self.board[qr] = colour
+        self.score = {'r': 0, 'g': 0, 'b': 0}
+        self.drawmsg = ""
+        self.nturns  = 0
+        self.history = defaultdict(int, {self._snap(): 1})
+
+    def update(self, colour, action):
+        """
+        Apply an action to the game, or raise an IllegalActionException if
+        it's not currently available.
+        """
+        col = colour[0]
+        if action not in self._available_actions(col):
+            raise IllegalActionException(f"{colour} player's action, "
+                f"{action!r}, is not available")
+        atype, aargs = action
+        if atype == "MOVE":
+            qr_a, qr_b = aargs
+            self.board[qr_a] = ' '
+            self.board[qr_b] = col
+        elif atype == "JUMP":
+            qr_a, qr_b = (q_a, r_a), (q_b, r_b) = aargs
+            qr_c = (q_a+q_b)//2, (r_a+r_b)//2
+            self.board[qr_a] = ' '
+            self.board[qr_b] = col
+            self.board[qr_c] = col
+        elif atype == "EXIT":
+            self.board[aargs] = ' '
+            self.score[col] += 1
+        self._turn_detect_draw()
+
+    def _available_actions(self, colour):
+        available_actions = []
+        for qr in self.hexes:
+            if self.board[qr] == colour:
+                if qr in FINISHING_HEXES[colour]:
+                    available_actions.append(("EXIT", qr))
+                q, r = qr
+                for dq, dr in ADJACENT_STEPS:
+                    for i, atype in [(1, "MOVE"), (2, "JUMP")]:
+                        tqr = q+dq*i, r+dr*i
+                        if tqr in self.hexes:
+                            if self.board[tqr] == ' ':
+                                available_actions.append((atype, (qr, tqr)))
+                                break
+        if not available_actions:
+            available_actions.append(("PASS", None))
+        return available_actions
+
+    def _turn_detect_draw(self):
+        self.nturns += 1
+        if self.nturns >= _MAX_TURNS * 3:
+            self.drawmsg = "maximum number of turns reached."
+        state = self._snap()
+        self.history[state] += 1
+        if self.history[state] >= 4:
+            self.drawmsg = "game state occurred 4 times."
+    def _snap(self):
+        return (
+            tuple((qr,p) for qr,p in self.board.items() if p in "rgb"),
+            self.nturns % 3,
+        )
+
+    def over(self):
+        return (max(self.score.values()) >= 4) or (self.drawmsg != "")
+    def end(self):
+        if self.over():
+            if self.drawmsg == "":
+                winner = max("rgb", key=self.score.get)
+                return f"winner: {_COL_NAME[winner]}"
+            return f"draw detected: {self.drawmsg}"
+
+
+class BatchLane:
+    """
+    One lane of a referee.batch.BatchSimulator, behind as much of Chexers'
+    interface as check needs (with no search API).
+
+    The simulator runs LANES games in lockstep: the first plays the actions
+    it's given, and the rest play random legal actions alongside it (from a
+    fixed seed), so that the lanes are also checked to keep out of each
+    other's way.
+    """
+    LANES = 4
+    def __init__(self, logfilename=None):
+        # NOTE: imported here, since the batch simulator needs NumPy (which
+        # BatchSimulator checks for)
+        self.sim = BatchSimulator(self.LANES)
+        import numpy as np
+        self._rng = np.random.default_rng(0)
+
+    def _legal(self):
+        """The first lane's legal actions, with their slots."""
+        games, slots = self.sim.actions()
+        legal = {slot_to_action(slot): slot for slot in slots[games == 0]}
+        return legal or {("PASS", None): PASS_SLOT}
+
+    def _available_actions(self, colour):
+        # (only ever asked for the colour whose turn it is)
+        return list(self._legal())
+
+    def update(self, colour, action):
+        # (compared by equality, as the reference does, rather than looked
+        # up, since actions can be unhashable)
+        slot = next((slot for legal, slot in self._legal().items()
+            if legal == action), None)
+        if slot is None:
+            raise IllegalActionException(f"{colour} player's action, "
+                f"{action!r}, is not available")
+        slots = self.sim.random_actions(self._rng)
+        slots[0] = slot
+        self.sim.apply(slots)
+
+    @property
+    def board(self):
+        return {qr: " rgb"[value]
+            for qr, value in zip(CELLS, self.sim.boards[0])}
+    @property
+    def score(self):
+        return dict(zip("rgb", map(int, self.sim.score[0])))
+    @property
+    def nturns(self):
+        return self.sim.nturns
+    @property
+    def drawmsg(self):
+        return DRAW_MESSAGES[self.sim.draw[0]]
+
+    def _history_key(self):
+        return int(self.sim.hash[0])
+    @property
+    def history(self):
+        """The current state's count in the first lane's history."""
+        return {self._history_key(): self.sim._seen(0)}
+
+    def over(self):
+        return bool(self.sim.over[0])
+    def end(self):
+        if self.over():
+            if self.drawmsg == "":
+                return f"winner: {_COL_NAME['rgb'[self.sim.winner[0]]]}"
+            return f"draw detected: {self.drawmsg}"
+
+
+# Comparing engines
+
+def observe(game):
+    """
+    The state of a game (of either engine) in a form to compare: a dict of
+    the board (colours by hex), scores, turn count, draw message, repetition
+    count of the current state, and whether the game is over.
+    """
+    if hasattr(game, "_history_key"):
+        key = game._history_key()
+    else:
+        key = game._snap()
+    return {
+        'board': {qr: game.board[qr] for qr in CELLS},
+        'score': dict(game.score),
+        'nturns': game.nturns,
+        'drawmsg': game.drawmsg,
+        'repetitions': game.history.get(key, 0),
+        'over': game.over(),
+    }
+
+def _differences(expected, actual):
+    """Describe how an observed state differs from the expected state."""
+    differences = []
+    for field, value in expected.items():
+        if field == 'board':
+            cells = [qr for qr in CELLS if value[qr] != actual['board'][qr]]
+            if cells:
+                differences.append("board differs at " + ", ".join(
+                    f"{qr} ({value[qr]!r} vs {actual['board'][qr]!r})"
+                    for qr in cells))
+        elif actual[field] != value:
+            differences.append(f"{field} differs ({value!r} vs "
+                f"{actual[field]!r})")
+    return "; ".join(differences)
+
+def check(Engine, actions, roundtrip=True):
+    """
+    Play a sequence of actions through the reference engine and an `Engine`
+    (a class like referee.game.Chexers), each action for the colour whose
+    turn it is, up to the end of the game. Return the first disagreement
+    between them, as a pair of the index of the action involved (or the
+    number of actions, for the result) and a description, or None if they
+    agree throughout.
+
+    If `roundtrip` (and the engine has a search API), also check the
+    engine's moves and its making and unmaking of each legal action.
+    """
+    reference, game = ReferenceChexers(), Engine(None)
+    search = roundtrip and hasattr(game, "make_move")
+    state = observe(reference)
+    difference = _differences(state, observe(game))
+    if difference:
+        return 0, f"initial states differ: {difference}"
+
+    for i, action in enumerate(actions):
+        if reference.over():
+            actions = actions[:i]
+            break
+        colour = _COLOURS[reference.nturns % 3]
+        actions_list = reference._available_actions(colour[0])
+        legal = set(actions_list)
+        try:
+            found = set(game._available_actions(colour[0]))
+        except Exception as e:
+            return i, f"listing {colour}'s actions raised {e!r}"
+        if found != legal:
+            return i, (f"{colour}'s legal actions differ: missing "
+                f"{sorted(legal - found, key=repr)}, extra "
+                f"{sorted(found - legal, key=repr)}")
+        # (a list, unlike a set, can be searched for unhashable actions)
+        if search and action in actions_list:
+            problem = _check_search(game, colour, action, legal)
+            if problem:
+                return i, problem
+
+        try:
+            reference.update(colour, action)
+            accepted = True
+        except IllegalActionException:
+            accepted = False
+        try:
+            game.update(colour, action)
+            if not accepted:
+                return i, f"{colour}'s illegal action {action!r} accepted"
+        except IllegalActionException:
+            if accepted:
+                return i, f"{colour}'s legal action {action!r} rejected"
+        except Exception as e:
+            return i, f"{colour}'s action {action!r} raised {e!r}"
+
+        state = observe(reference)
+        difference = _differences(state, observe(game))
+        if difference:
+            return i, f"after {colour}'s action {action!r}: {difference}"
+
+    if reference.over() and reference.end() != game.end():
+        return len(actions), (f"results differ ({reference.end()!r} vs "
+            f"{game.end()!r})")
+    return None
+
+def _check_search(game, colour, action, legal):
+    """
+    Check an engine's search API on the action it's about to take: its
+    moves must match the legal actions, and making and then unmaking the
+    action's move must restore the state. Return a description of any
+    problem (or None).
+    """
+    moves = game.moves()
+    if set(map(move_to_action, moves)) != legal or len(moves) != len(legal):
+        return f"{colour}'s moves differ from its legal actions: {moves}"
+    move = next(m for m in moves if move_to_action(m) == action)
+    before = observe(game), getattr(game, "hash", None)
+    try:
+        game.unmake_move(game.make_move(move))
+    except Exception as e:
+        return f"making and unmaking {colour}'s {move!r} raised {e!r}"
+    difference = _differences(before[0], observe(game))
+    if difference:
+        return f"making and unmaking {colour}'s {move!r}: {difference}"
+    if getattr(game, "hash", None) != before[1]:
+        return f"making and unmaking {colour}'s {move!r} changed the hash"
+    return None
+
+def shrink(Engine, actions, roundtrip=True):
+    """
+    Shrink a sequence of actions on which `Engine` disagrees with the
+    reference (see check) to a (locally) minimal one: from which no run of
+    actions can be removed without the engines agreeing. Return the shrunk
+    sequence and its disagreement.
+    """
+    failure = check(Engine, actions, roundtrip)
+    actions = actions[:failure[0] + 1]
+    # try removing runs of actions, halving the length of the runs each
+    # time none can be removed
+    n = max(len(actions) // 2, 1)
+    while True:
+        removed = False
+        i = 0
+        while i < len(actions):
+            trial = actions[:i] + actions[i+n:]
+            trial_failure = check(Engine, trial, roundtrip)
+            if trial_failure is not None:
+                actions = trial[:trial_failure[0] + 1]
+                failure = trial_failure
+                removed = True
+            else:
+                i += n
+        if n == 1 and not removed:
+            return actions, failure
+        if not removed:
+            n //= 2
+
+
+# Generating games
+
+def _random_policy(rng, actions, last):
+    return rng.choice(actions)
+def _repeat_policy(rng, actions, last):
+    """Mostly undo the colour's last move, to repeat positions."""
+    if last is not None and last[0] == "MOVE" and rng.random() < 0.8:
+        back = ("MOVE", last[1][::-1])
+        if back in actions:
+            return back
+    return rng.choice(actions)
+def _race_policy(rng, actions, last):
+    """Mostly exit, or else jump, to finish games (and take pieces)."""
+    for atype in ("EXIT", "JUMP"):
+        options = [a for a in actions if a[0] == atype]
+        if options and rng.random() < 0.8:
+            return rng.choice(options)
+    return rng.choice(actions)
+POLICIES = [_random_policy, _repeat_policy, _race_policy]
+
+def _illegal_action(rng, game, colour):
+    """
+    An action which is probably illegal or malformed (but sometimes legal,
+    or legal-looking: e.g. with float coordinates).
+    """
+    actions = game._available_actions(colour[0])
+    atype, aargs = rng.choice(actions)
+    qr = rng.choice(CELLS)
+    kind = rng.randrange(10)
+    if kind == 0:
+        # between two random hexes
+        return (rng.choice(["MOVE", "JUMP"]), (qr, rng.choice(CELLS)))
+    if kind == 1:
+        # another colour's action
+        other = rng.choice([c for c in _COLOURS if c != colour])
+        return rng.choice(game._available_actions(other[0]))
+    if kind == 2:
+        # a legal action's arguments, for the wrong type of action
+        if atype == "EXIT":
+            return (rng.choice(["MOVE", "JUMP"]), (aargs, qr))
+        if atype in ("MOVE", "JUMP"):
+            return (rng.choice(["MOVE", "JUMP", "EXIT"]), aargs
+                if rng.random() < 0.5 else aargs[0])
+        return ("EXIT", qr)
+    if kind == 3:
+        return ("EXIT", qr)
+    if kind == 4:
+        return ("PASS", None)
+    if kind == 5:
+        # off the board
+        return ("MOVE", (qr, (rng.randint(-5, 5), rng.randint(-5, 5))))
+    if kind == 6 and atype in ("MOVE", "JUMP"):
+        # lists instead of tuples
+        return rng.choice([[atype, aargs], (atype, list(aargs)),
+            (atype, (list(aargs[0]), aargs[1]))])
+    if kind == 7 and atype in ("MOVE", "JUMP"):
+        # float coordinates (equal to the legal ones)
+        (q_a, r_a), qr_b = aargs
+        return (atype, ((float(q_a), float(r_a)), qr_b))
+    if kind == 8:
+        return rng.choice([None, "PASS", ("PASS",), ("PASS", None, None),
+            (atype,), ("EXIT", (0, 0, 0)), ("EXIT", [0, 0]), ("PASS", ())])
+    # a mangled action type
+    return (atype.lower(), aargs)
+
+def generate(seed, illegal=0.05):
+    """
+    Generate a game's sequence of actions from a seed: chosen by one of the
+    POLICIES (by seed), except for a fraction `illegal` of actions chosen
+    to be illegal or malformed (see _illegal_action).
+    """
+    rng = random.Random(seed)
+    policy = POLICIES[seed % len(POLICIES)]
+    game = ReferenceChexers()
+    actions, last = [], {}
+    while not game.over():
+        colour = _COLOURS[game.nturns % 3]
+        if rng.random() < illegal:
+            action = _illegal_action(rng, game, colour)
+        else:
+            action = policy(rng, game._available_actions(colour[0]),
+                last.get(colour))
+            last[colour] = action
+        actions.append(action)
+        try:
+            game.update(colour, action)
+        except IllegalActionException:
+            pass
+    return actions
+
+
+# Running
+
+# engines by short name (see load_engine)
+ENGINES = {
+    "chexers": "referee.game:Chexers",
+    "batch": "referee.fuzz:BatchLane",
+}
+
+def load_engine(spec, exact_history=False):
+    """
+    Load an engine class from a 'module[:class]' specification (the class
+    defaults to Chexers), or a short name from ENGINES, with its exact
+    history option set if asked. Raise ValueError if it has no such option.
+    """
+    module, _, name = ENGINES.get(spec, spec).partition(":")
+    Engine = getattr(importlib.import_module(module), name or "Chexers")
+    if exact_history:
+        if "exact_history" not in inspect.signature(Engine).parameters:
+            raise ValueError(f"engine {spec} has no exact history option")
+        Engine = functools.partial(Engine, exact_history=True)
+    return Engine
+
+def _default_engines(exact_history):
+    """The engines to check if none are given."""
+    engines = ["chexers"]
+    try:
+        import numpy
+        if not exact_history:
+            engines.append("batch")
+    except ImportError:
+        pass
+    return engines
+
+_engines = None
+def _start_worker(specs, exact_history):
+    global _engines
+    _engines = [(spec, load_engine(spec, exact_history)) for spec in specs]
+
+def fuzz_game(seed, illegal=0.05, roundtrip=True):
+    """
+    Generate and check a game against each engine (in a worker, see
+    _start_worker). Return the seed, the number of actions, and for each
+    engine that disagreed, its specification, the shrunk sequence of
+    actions and the disagreement.
+    """
+    actions = generate(seed, illegal)
+    failures = []
+    for spec, Engine in _engines:
+        if check(Engine, actions, roundtrip) is not None:
+            shrunk, failure = shrink(Engine, actions, roundtrip)
+            failures.append((spec, shrunk, failure))
+    return seed, len(actions), failures
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m referee.fuzz",
+        description="Check a Chexers engine against the reference rules, on "
+            "many generated games.")
+    parser.add_argument('-e', '--engine', dest='engines', action='append',
+        metavar="MODULE[:CLASS]",
+        help="an engine to check, or one of: "
+            f"{', '.join(ENGINES)} (may be repeated; default: chexers, and "
+            "batch if NumPy is installed and not with -x)")
+    parser.add_argument('-x', '--exact-history', action="store_true",
+        help="create the engine with exact_history=True")
+    parser.add_argument('-n', '--games', type=int, default=1000,
+        help="how many games to play (default: %(default)s)")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+        help="the seed of the first game (the rest follow on from it; "
+            "default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="how many processes to play games in (default: one per CPU "
+            "core)")
+    parser.add_argument('-p', '--illegal', type=float, default=0.05,
+        help="the fraction of actions chosen to be illegal (default: "
+            "%(default)s)")
+    parser.add_argument('--no-roundtrip', dest='roundtrip',
+        action="store_false",
+        help="don't check the engine's moves and make/unmake")
+    parser.add_argument('-f', '--fail-fast', action="store_true",
+        help="stop at the first disagreement")
+    args = parser.parse_args()
+
+    engines = args.engines or _default_engines(args.exact_history)
+    # (load the engines here first, to report any problem with them once)
+    for spec in engines:
+        try:
+            load_engine(spec, args.exact_history)
+        except (ImportError, AttributeError, ValueError) as e:
+            parser.error(f"can't load engine {spec}: {e}")
+    print(f"* checking {', '.join(engines)} against the reference rules")
+
+    seeds = range(args.seed, args.seed + args.games)
+    work = functools.partial(fuzz_game, illegal=args.illegal,
+        roundtrip=args.roundtrip)
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(args.jobs, _start_worker,
+        (engines, args.exact_history))
+    start = time.perf_counter()
+    ngames = nactions = nfailures = 0
+    try:
+        for seed, n, failures in pool.imap_unordered(work, seeds,
+                chunksize=8):
+            ngames += 1
+            nactions += n
+            for spec, shrunk, (index, description) in failures:
+                nfailures += 1
+                print(f"* game {seed} ({n} actions) disagrees with {spec}, "
+                    f"after shrinking to {len(shrunk)} actions, at action "
+                    f"{index}: {description}")
+                for i, action in enumerate(shrunk):
+                    print(f"*   {i:3d}: {action!r}")
+            if failures and args.fail_fast:
+                break
+    finally:
+        pool.terminate()
+    elapsed = time.perf_counter() - start
+    print(f"* {ngames} games, {nactions} actions in {elapsed:.1f}s "
+        f"({nactions / elapsed:.0f} actions/s): {nfailures} disagreements")
+    if nfailures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
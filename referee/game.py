@@ -1,7 +1,8 @@
 """
 Provide a class to maintain the state of an evolving game
 of Chexers, including validation of actions, detection of draws,
-and optionally maintaining a game log.
+and optionally maintaining a game log (and a binary game record: see
+referee.record).
 
 NOTE: This board representation is designed to be used intenrally by the referee
 for the purposes of validating actions and displaying the result of the game.
@@ -10,25 +11,22 @@ for use in informing decisions about which action to choose each turn. Please
 don't look to this module as an example of a useful board representation for
 these purposes; you should think carefully about how to design your own data
 structures for representing the state of a game.
+
+That said, the Chexers class also offers a move generation and make/unmake
+API (see Chexers.moves), with which a search can explore the game tree on a
+single instance (with logging disabled) without copying its state.
 """
 
 import sys
 import time
 from collections import defaultdict
 
+from referee.board import Bitboard, CELLS, CELL_INDEX, JUMPED
+from referee.board import ZOBRIST, ZOBRIST_TURN, zobrist_hash
+from referee.log import LogWriter
+
 # Game-specific constants:
 
-_STARTING_HEXES = {
-    'r': {(-3,3), (-3,2), (-3,1), (-3,0)},
-    'g': {(0,-3), (1,-3), (2,-3), (3,-3)},
-    'b': {(3, 0), (2, 1), (1, 2), (0, 3)},
-}
-_FINISHING_HEXES = {
-    'r': {(3,-3), (3,-2), (3,-1), (3,0)},
-    'g': {(-3,3), (-2,3), (-1,3), (0,3)},
-    'b': {(-3,0),(-2,-1),(-1,-2),(0,-3)},
-}
-_ADJACENT_STEPS = [(-1,+0),(+0,-1),(+1,-1),(+1,+0),(+0,+1),(-1,+1)]
 _MAX_TURNS = 256 # per player
 
 
@@ -99,30 +97,52 @@ _TEMPLATE_DEBUG = """*   scores: {0}
 class Chexers:
     """
     Represent the evolving state of a game of Chexers. Main useful methods
-    are __init__, update, display, over and end.
+    are __init__, update, display, over and end (and for search, moves,
+    make_move and unmake_move).
+
+    If `recorder` is given (a referee.record.GameRecorder), each action is
+    also added to the game's binary record, which is written out when the
+    game ends (or is closed).
     """
-    def __init__(self, logfilename):
+    def __init__(self, logfilename, exact_history=False, recorder=None):
         # initialise game board state:
-        ran = range(-3, +3+1)
-        self.hexes = {(q,r) for q in ran for r in ran if -q-r in ran}
-        self.board = {qr: ' ' for qr in self.hexes}
-        for colour in "rgb":
-            for qr in _STARTING_HEXES[colour]:
-                self.board[qr] = colour
+        self.hexes = set(CELLS)
+        self.board = Bitboard()
         
         # also keep track of some other state variables for win/draw
         # detection (score, number of turns, state history)
         self.score = {'r': 0, 'g': 0, 'b': 0}
         self.drawmsg = ""
         self.nturns  = 0
-        self.history = defaultdict(int, {self._snap(): 1})
+        # the state history is keyed by an incrementally-updated Zobrist hash
+        # of the state, or (if exact_history) by the exact state itself, to
+        # rule out any chance of a hash collision causing a false draw
+        self.hash = zobrist_hash(self.board.pieces, self.nturns)
+        self.exact_history = exact_history
+        self.history = defaultdict(int, {self._history_key(): 1})
 
         # and we might like to log actions!
         if logfilename is not None:
-            self._logfile = open(logfilename, 'w')
+            self._logfile = LogWriter(logfilename)
             self._log("game", "Start Chexers game log at", time.asctime())
         else:
             self._logfile = None
+        self._recorder = recorder
+
+    @classmethod
+    def from_position(cls, pieces, score, nturns, exact_history=False):
+        """
+        A game (without a log) starting from a given position: a dict of
+        cell masks and one of scores (by colour), at turn number `nturns`.
+        The state history starts afresh from the position.
+        """
+        game = cls(None, exact_history)
+        game.board = Bitboard(pieces)
+        game.score = dict(score)
+        game.nturns = nturns
+        game.hash = zobrist_hash(game.board.pieces, nturns)
+        game.history = defaultdict(int, {game._history_key(): 1})
+        return game
         
     def update(self, colour, action):
         """
@@ -132,81 +152,210 @@ class Chexers:
         Otherwise, apply the action to the game state.
         """
         col = colour[0]
-        available_actions = self._available_actions(col)
-        if action in available_actions:
-            atype, aargs = action
-            if atype == "MOVE":
-                qr_a, qr_b = aargs
-                self.board[qr_a] = ' '
-                self.board[qr_b] = col
-            elif atype == "JUMP":
-                qr_a, qr_b = (q_a, r_a), (q_b, r_b) = aargs
-                qr_c = (q_a+q_b)//2, (r_a+r_b)//2
-                self.board[qr_a] = ' '
-                self.board[qr_b] = col
-                self.board[qr_c] = col
-            elif atype == "EXIT":
-                qr = aargs
-                self.board[qr] = ' '
-                self.score[col] += 1
-            else: # atype == "PASS":
-                pass
+        if self._is_legal(col, action):
+            move = action_to_move(action)
+            token = self._apply(col, move)
             self._log_action(colour, action)
-            self._turn_detect_draw()
+            if self._recorder is not None:
+                # (a replaced state history means an irreversible action)
+                self._recorder.add(self, move, token[4] is not None)
 
         else:
             result = f"illegal action detected ({colour}): {action!r}."
             self._log("error", result)
             # NOTE: The game instance _could_ potentially be recovered, but:
+            if self._recorder is not None:
+                self._recorder.illegal(col)
             self._end_log()
+            available_actions = self._available_actions(col)
             available_actions_list = '\n*   '.join(map(str, available_actions))
             raise IllegalActionException(
                 f"{colour} player's action, {action!r}, is not well-formed or "
                 "not available. See specification and game rules for details, "
                 "or consider currently available actions:\n"
                 f"*   {available_actions_list}")
+    def _is_legal(self, colour, action):
+        """
+        True iff this action is well-formed and currently available to a
+        particular player. Equivalent to `action in
+        self._available_actions(colour)`, but checks only this action
+        (in constant time) instead of building the list of all actions.
+        """
+        if not isinstance(action, tuple) or len(action) != 2:
+            return False
+        atype, aargs = action
+        try:
+            if atype == "MOVE" or atype == "JUMP":
+                if not isinstance(aargs, tuple) or len(aargs) != 2:
+                    return False
+                qr_a, qr_b = aargs
+                if not (isinstance(qr_a, tuple) and isinstance(qr_b, tuple)):
+                    return False
+                a, b = CELL_INDEX.get(qr_a), CELL_INDEX.get(qr_b)
+                if a is None or b is None:
+                    return False
+                if atype == "MOVE":
+                    return self.board.is_move(colour, a, b)
+                return self.board.is_jump(colour, a, b)
+            if atype == "EXIT":
+                if not isinstance(aargs, tuple):
+                    return False
+                a = CELL_INDEX.get(aargs)
+                return a is not None and self.board.is_exit(colour, a)
+            if atype == "PASS":
+                return aargs is None and not self.board.has_actions(colour)
+        except TypeError: # e.g. unhashable coordinates
+            return False
+        return False
+    def _apply(self, col, move):
+        """
+        Apply a (legal) move for colour `col` to the game state, returning a
+        token with which to undo it (see unmake_move).
+        """
+        atype, a, b = move
+        keys = ZOBRIST[col]
+        over = None
+        irreversible = False
+        if atype == "MOVE":
+            self.board.move(col, a, b)
+            self.hash ^= keys[a] ^ keys[b]
+        elif atype == "JUMP":
+            over = self.board.jump(col, a, b)
+            self.hash ^= keys[a] ^ keys[b]
+            if over != col:
+                # the jumped-over piece was converted
+                c = JUMPED[a][b]
+                self.hash ^= ZOBRIST[over][c] ^ keys[c]
+                # (and if that was its colour's last piece, the colour
+                # can never get pieces back: see _turn_detect_draw)
+                irreversible = not self.board.pieces[over]
+        elif atype == "EXIT":
+            self.board.exit(col, a)
+            self.hash ^= keys[a]
+            self.score[col] += 1
+            irreversible = True
+        else: # atype == "PASS":
+            pass
+        drawmsg, history = self._turn_detect_draw(irreversible)
+        return (move, col, over, drawmsg, history)
+
+    # Search API: The following methods let a player's search explore the
+    # game tree on a single Chexers instance, making and unmaking moves rather
+    # than copying the state. Moves are compact versions of actions: tuples
+    # (atype, a, b) of an action type and the numbers of the cells involved
+    # (see referee.board), with -1 for any cell not involved. For example,
+    # ("MOVE", 18, 19), ("EXIT", 36, -1) or ("PASS", -1, -1).
+
+    def turn(self):
+        """The colour ('r', 'g' or 'b') of the player whose turn it is."""
+        return "rgb"[self.nturns % 3]
+    def moves(self, colour=None):
+        """
+        A list of the moves currently available to a particular player (by
+        default, the player whose turn it is), ending with a pass if there
+        are no other moves.
+        """
+        if colour is None:
+            colour = self.turn()
+        board = self.board
+        moves = [("EXIT", a, -1) for a in board.exits(colour)]
+        moves += [("MOVE", a, b) for a, b in board.moves(colour)]
+        moves += [("JUMP", a, b) for a, b in board.jumps(colour)]
+        if not moves:
+            moves.append(_PASS_MOVE)
+        return moves
+    def make_move(self, move):
+        """
+        Apply a legal move for the player whose turn it is, without any
+        validation or logging. Return an undo token for unmake_move.
+        """
+        return self._apply(self.turn(), move)
+    def unmake_move(self, token):
+        """
+        Undo the most recent move made (and not yet unmade), given the token
+        returned by make_move when it was made: restoring the board, score,
+        turn count, state history and draw detection.
+        """
+        (atype, a, b), col, over, drawmsg, history = token
+        # undo the turn (see _turn_detect_draw)
+        if history is None:
+            state = self._history_key()
+            self.history[state] -= 1
+            if not self.history[state]:
+                del self.history[state]
+        else:
+            self.history = history
+        self.drawmsg = drawmsg
+        self.hash ^= ZOBRIST_TURN[self.nturns % 3]
+        self.nturns -= 1
+        self.hash ^= ZOBRIST_TURN[self.nturns % 3]
+
+        # then undo the action itself
+        keys = ZOBRIST[col]
+        if atype == "MOVE":
+            self.board.move(col, b, a)
+            self.hash ^= keys[a] ^ keys[b]
+        elif atype == "JUMP":
+            self.board.move(col, b, a)
+            self.hash ^= keys[a] ^ keys[b]
+            if over != col:
+                c = JUMPED[a][b]
+                self.board.convert(over, c)
+                self.hash ^= ZOBRIST[over][c] ^ keys[c]
+        elif atype == "EXIT":
+            self.board.enter(col, a)
+            self.hash ^= keys[a]
+            self.score[col] -= 1
+
     def _available_actions(self, colour):
         """
         A list of currently-available actions for a particular player
         (assists validation).
         """
-        available_actions = []
-        for qr in self.hexes:
-            if self.board[qr] == colour:
-                if qr in _FINISHING_HEXES[colour]:
-                    available_actions.append(("EXIT", qr))
-                q, r = qr
-                for dq, dr in _ADJACENT_STEPS:
-                    for i, atype in [(1, "MOVE"), (2, "JUMP")]:
-                        tqr = q+dq*i, r+dr*i
-                        if tqr in self.hexes:
-                            if self.board[tqr] == ' ':
-                                available_actions.append((atype, (qr, tqr)))
-                                break
-        if not available_actions:
-            available_actions.append(("PASS", None))
-        return available_actions
-    def _turn_detect_draw(self):
+        return self.board.actions(colour)
+    def _turn_detect_draw(self, irreversible=False):
         """
         Register that a turn has passed: Update turn counts and 
-        detect repeated game states.
+        detect repeated game states. Return the previous draw message and
+        (if it was replaced) the previous state history, for undoing this.
+
+        If the turn's action was irreversible, no earlier state can occur
+        again, so the state history is cleared first. This keeps the history
+        no larger than the longest run of reversible turns. Irreversible
+        actions are exits (the number of pieces on the board never goes back
+        up) and jumps converting a colour's last piece (a colour with no
+        pieces can never convert any back). Other conversions don't count:
+        a later conversion in the other direction can restore every colour's
+        piece count, and so an earlier state.
         """
+        drawmsg, history = self.drawmsg, None
+        self.hash ^= ZOBRIST_TURN[self.nturns % 3]
         self.nturns += 1
+        self.hash ^= ZOBRIST_TURN[self.nturns % 3]
         if self.nturns >= _MAX_TURNS * 3:
             self.drawmsg = "maximum number of turns reached."
         
-        state = self._snap()
+        if irreversible:
+            history, self.history = self.history, defaultdict(int)
+        state = self._history_key()
         self.history[state] += 1
         if self.history[state] >= 4:
             self.drawmsg = "game state occurred 4 times."
+        return drawmsg, history
+    def _history_key(self):
+        """The key of the current state in the state history"""
+        if self.exact_history:
+            return self._snap()
+        return self.hash
     def _snap(self):
         """
         Capture the current board state in a hashable way
         (for repeated-state checking)
         """
+        pieces = self.board.pieces
         return (
             # same colour pieces in the same positions
-            tuple((qr,p) for qr,p in self.board.items() if p in "rgb"),
+            (pieces['r'], pieces['g'], pieces['b']),
             # on the same player's turn
             self.nturns % 3,
         )
@@ -242,31 +391,81 @@ class Chexers:
             template = _TEMPLATE_DEBUG
         else:
             template = _TEMPLATE_NORMAL
-        cells = []
-        ran = range(-3, +3+1)
-        for qr in [(q,r) for q in ran for r in ran if -q-r in ran]:
-            cells.append(_DISPLAY[self.board[qr]])
+        cells = [_DISPLAY[self.board.colour_at(n)] for n in range(len(CELLS))]
         score_template = "Red: {r} exits, Green: {g} exits, Blue: {b} exits."
         score_str = score_template.format(**self.score)
         return template.format(score_str, *cells)
 
+    def close(self):
+        """
+        Close the logfile and write out the game record (if any), even if the
+        game is not over (e.g. if a player broke a resource limit).
+        """
+        self._end_log()
+
     def _log(self, header, *messages):
         """Helper method to add a message to the logfile"""
         if self._logfile is not None:
-            print(f"[{header:5s}] -", *messages, file=self._logfile, flush=True)
+            self._logfile.write(header, *messages)
     def _log_action(self, colour, action):
         """Helper method to log an action to the logfile"""
-        atype, aargs = action
-        if atype in {"JUMP", "MOVE"}:
-            self._log(colour, f"{atype} from {aargs[0]} to {aargs[1]}.")
-        elif atype == "EXIT":
-            self._log(colour, f"{atype} from {aargs}.")
-        else: #atype == "PASS":
-            self._log(colour, f"{atype}.")
+        if self._logfile is not None:
+            # (described by the log's writer, off the game's thread)
+            self._logfile.write_with(colour, describe_action, action)
     def _end_log(self):
         if self._logfile is not None:
             self._logfile.close()
             self._logfile = None
+        if self._recorder is not None:
+            self._recorder.close(self)
+            self._recorder = None
+
+def describe_action(action):
+    """Describe a (well-formed) action, as in the game log."""
+    atype, aargs = action
+    if atype in {"JUMP", "MOVE"}:
+        return f"{atype} from {aargs[0]} to {aargs[1]}."
+    elif atype == "EXIT":
+        return f"{atype} from {aargs}."
+    else: #atype == "PASS":
+        return f"{atype}."
+
+_PASS_MOVE = ("PASS", -1, -1)
+
+def action_to_move(action):
+    """Convert a (well-formed) action into a move (see Chexers.moves)."""
+    atype, aargs = action
+    if atype == "MOVE" or atype == "JUMP":
+        qr_a, qr_b = aargs
+        return (atype, CELL_INDEX[qr_a], CELL_INDEX[qr_b])
+    if atype == "EXIT":
+        return (atype, CELL_INDEX[aargs], -1)
+    return _PASS_MOVE
+def move_to_action(move):
+    """Convert a move (see Chexers.moves) into an action."""
+    atype, a, b = move
+    if atype == "MOVE" or atype == "JUMP":
+        return (atype, (CELLS[a], CELLS[b]))
+    if atype == "EXIT":
+        return (atype, CELLS[a])
+    return ("PASS", None)
+
+# Compact encoding of moves in 16 bits (for game records, players' tables,
+# and the pipes to isolated players): a type code (two bits) and two cell
+# numbers (six bits each, NO_CELL for an unused cell)
+MOVE_TYPES = ["PASS", "MOVE", "JUMP", "EXIT"]
+_MOVE_CODES = {atype: code for code, atype in enumerate(MOVE_TYPES)}
+NO_CELL = 63
+
+def pack_move(move):
+    """Encode a move as a 16-bit code (never more than 0x3FFF)."""
+    atype, a, b = move
+    return _MOVE_CODES[atype] << 12 | (a & NO_CELL) << 6 | (b & NO_CELL)
+def unpack_move(code):
+    """Decode a move encoded by pack_move."""
+    a, b = code >> 6 & NO_CELL, code & NO_CELL
+    return (MOVE_TYPES[code >> 12], -1 if a == NO_CELL else a,
+        -1 if b == NO_CELL else b)
 
 class IllegalActionException(Exception):
     """If this action is illegal based on the current board state."""
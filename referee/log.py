@@ -0,0 +1,117 @@
+"""
+Write the referee's game log (see Chexers._log) in the background: log
+records are queued by the game, then formatted and written out in batches
+by a thread of their own, so that logging doesn't hold up the game with a
+write (and a flush) for every line.
+"""
+
+import atexit
+import threading
+from collections import deque
+
+# the most records waiting to be written (beyond this, logging waits for the
+# writer to catch up), and the most records written in one batch
+_QUEUE_SIZE = 4096
+_BATCH_SIZE = 256
+# once woken by a record, the writer waits this long (s) for more records to
+# write along with it (or until the log is closed)
+_GATHER_TIME = 0.005
+
+def log_line(header, *messages):
+    """A line of the game log: a header, then the messages."""
+    return " ".join([f"[{header:5s}] -"] + [str(m) for m in messages])
+
+def _format(header, describe, messages):
+    """The line for a record queued by LogWriter."""
+    if describe is not None:
+        messages = (describe(*messages),)
+    return log_line(header, *messages)
+
+class LogWriter:
+    """
+    Write log records (see log_line) to a file at `path`, in the background.
+
+    Records are written in the order they are queued, and all of them are
+    written by the time close returns (close is called at exit, too, if it
+    hasn't been already). If writing fails, the error is raised by the next
+    call to write or close.
+    """
+    def __init__(self, path):
+        # NOTE: imported here, so that players using referee.game needn't
+        # import the rest of the referee
+        from referee.player import start_referee_thread
+
+        self._file = open(path, 'w')
+        # (records are queued, and closing is flagged, under the condition's
+        # lock, so that the writer can't miss either: it waits on the
+        # condition for records (or to close), and logging waits on it for
+        # room in the queue. Popping from a deque is atomic, so the writer
+        # takes records off the queue without the lock.)
+        self._records = deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._error = None
+        self._thread = start_referee_thread(self._run)
+        atexit.register(self.close)
+
+    def write(self, header, *messages):
+        """Queue a record for the log."""
+        self._queue((header, None, messages))
+
+    def write_with(self, header, describe, *args):
+        """
+        Queue a record for the log whose message is `describe(*args)`, which
+        the writer calls (so the game needn't): `args` mustn't change after.
+        """
+        self._queue((header, describe, args))
+
+    def _queue(self, record):
+        self._check()
+        records = self._records
+        with self._condition:
+            if len(records) >= _QUEUE_SIZE:
+                self._condition.wait_for(lambda: len(records) < _QUEUE_SIZE)
+            records.append(record)
+            if len(records) == 1: # (the writer may be waiting for it)
+                self._condition.notify_all()
+
+    def close(self):
+        """Write out any queued records, and close the file."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        atexit.unregister(self.close)
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        records, condition = self._records, self._condition
+        closing = False
+        while not closing:
+            with condition:
+                condition.wait_for(lambda: records or self._closing)
+                condition.wait_for(lambda: self._closing, _GATHER_TIME)
+                # (once closing, every record has been queued already)
+                closing = self._closing
+            while records:
+                batch = [records.popleft()
+                    for _ in range(min(len(records), _BATCH_SIZE))]
+                with condition:
+                    condition.notify_all()
+                if self._error is not None:
+                    continue # (drop records after an error)
+                try:
+                    self._file.write("".join(_format(*record) + "\n"
+                        for record in batch))
+                    self._file.flush()
+                except Exception as e: # (in writing, or in describing)
+                    self._error = e
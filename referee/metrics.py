@@ -0,0 +1,95 @@
+"""
+A machine-readable stream of metrics about the players' resource usage, with
+one record per call to a player (see referee.player.PlayerWrapper), for
+profiling players across many games.
+
+The stream is JSON Lines (one JSON object per line), or CSV (with a header
+line) if the file name ends with '.csv'. Each record has the fields in
+FIELDS:
+* game: the game's number in a tournament (empty for a single game);
+* turn: the number of turns taken in the game before the call;
+* colour, method: the player, and which of its methods was called ('init',
+  'action' or 'update');
+* cpu: the CPU time (s) the call took, and clock: the player's total so far
+  (including any charged pondering);
+* gc: the CPU time (s) spent collecting garbage before the call (off the
+  clock), and ponder: the player's total time (s) spent pondering so far;
+* space, peak_space, resident: the current and peak virtual memory usage
+  and the resident set size (MB), as last measured (empty if they can't be
+  measured on this platform);
+* actions: for an action, the number of legal actions the player had to
+  choose from (counting a forced pass as one); empty otherwise.
+"""
+
+import os
+import json
+
+FIELDS = ("game", "turn", "colour", "method", "cpu", "clock", "gc", "ponder",
+    "space", "peak_space", "resident", "actions")
+
+# records are buffered, and written out in chunks of about this many bytes
+# (each chunk a whole number of lines, in a single write, so that several
+# games' processes can append to the same file without mixing up lines)
+_BUFFER_SIZE = 1 << 16
+# (times and space usage are rounded to this many decimal places)
+_PLACES = 6
+
+class MetricsWriter:
+    """
+    Write metrics records to a file at `path` (see the module docstring for
+    the format), for game number `game` (or None, for a single game).
+
+    Unless `append`, the file is started afresh (with a header, for CSV).
+    Otherwise records are added to the end of it, which is safe to do from
+    several processes at once (e.g. one per game of a tournament, after the
+    tournament has started the file).
+    """
+    def __init__(self, path, game=None, append=False):
+        self.csv = path.endswith(".csv")
+        self.game = game
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not append:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o644)
+        self._lines = []
+        self._size = 0
+        if self.csv and not append:
+            self._add(",".join(FIELDS) + "\n")
+
+    def record(self, turn, player, method, actions=None):
+        """
+        Record a call (to `method`, at turn number `turn`) to a player (a
+        PlayerWrapper), from the player's timer and space watcher.
+        """
+        timer, usage = player.timer, player.space.usage
+        values = (self.game, turn, player.colour, method, timer.elapsed,
+            timer.clock, timer.gc.elapsed, timer.ponder_clock) \
+            + (usage or (None, None, None)) + (actions,)
+        values = [round(v, _PLACES) if isinstance(v, float) else v
+            for v in values]
+        if self.csv:
+            line = ",".join("" if v is None else str(v) for v in values)
+        else:
+            line = json.dumps(dict(zip(FIELDS, values)))
+        self._add(line + "\n")
+
+    def _add(self, line):
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= _BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write out any buffered records."""
+        data = "".join(self._lines).encode()
+        self._lines.clear()
+        self._size = 0
+        while data:
+            data = data[os.write(self._fd, data):]
+
+    def close(self):
+        """Write out any buffered records, and close the file."""
+        if self._fd is not None:
+            self.flush()
+            os.close(self._fd)
+            self._fd = None
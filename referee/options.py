@@ -4,7 +4,10 @@ Provide a command-line argument parsing function using argparse
 
 --------------------------------------------------------------------------------
 usage: referee [-h] [-V] [-d [delay]] [-s [space_limit]] [-t [time_limit]]
-               [-D] [-v [{0,1,2,3}]] [-l [LOGFILE]]
+               [-g gc_policy] [-m N] [-i] [-P {off,charged,free}]
+               [-M METRICS] [-p SPEC] [--profiler {cprofile,sampling}]
+               [--profile-prefix PREFIX] [-T [TRACEFILE]] [-D]
+               [-v [{0,1,2,3}]] [-l [LOGFILE]] [-R [RECORDFILE]]
                red green blue
 
 Conducts a game of Chexers between three Player classes.
@@ -40,6 +43,49 @@ optional arguments:
                         limit on memory space (float, MB) for each player
   -t [time_limit], --time [time_limit]
                         limit on CPU time (float, seconds) for each player
+  -g gc_policy, --gc gc_policy
+                        how to collect garbage before each call to a player
+                        (off the clock): 'full' (default) collection before
+                        every call, 'young' (youngest generation only) before
+                        every call, or 'every:N' (full collection before every
+                        Nth call only)
+  -m N, --space-sampling N
+                        measure each player's space usage in full only every N
+                        calls (or when it seems to have grown), for less
+                        overhead (default: 1, every call)
+  -i, --isolate         run each player in a process of its own (measuring
+                        each player's space usage separately)
+  -P {off,charged,free}, --ponder {off,charged,free}
+                        let players with a ponder method think during the
+                        other players' turns: 'off' (default), 'charged'
+                        (pondering counts against the player's time limit)
+                        or 'free' (it is measured, but off the clock)
+                        (implies --isolate)
+  -M METRICS, --metrics METRICS
+                        write a record of each player's resource usage for
+                        each call to it to a file named METRICS (as JSON
+                        Lines, or CSV if METRICS ends with '.csv'; see
+                        referee.metrics)
+  -p SPEC, --profile SPEC
+                        profile the calls to the players selected by SPEC:
+                        'COLOURS[:TURNS[:METHODS]]', e.g. 'red',
+                        'red,blue:100-200' or 'all:-50:action' (may be
+                        repeated; see referee.profiling) (not with
+                        --isolate)
+  --profiler {cprofile,sampling}
+                        how to profile the selected calls: 'cprofile'
+                        (default; writes PREFIX-COLOUR.prof; slows the
+                        player's code, which counts towards its time) or
+                        'sampling' (writes collapsed stacks,
+                        PREFIX-COLOUR.folded; its sampling is off the clock)
+  --profile-prefix PREFIX
+                        start the names of the profile files with PREFIX
+                        (default: profile)
+  -T [TRACEFILE], --trace [TRACEFILE]
+                        write a timeline of the game (the referee's work,
+                        each call to a player, and garbage collection) to a
+                        file named TRACEFILE, in Chrome's trace event format
+                        (default: trace.json)
   -D, --debug           switch to printing the debug board (with coordinates)
                         (overrides -v option; equivalent to -v or -v3)
   -v [{0,1,2,3}], --verbosity [{0,1,2,3}]
@@ -52,11 +98,19 @@ optional arguments:
                         if you supply this flag the referee will create a log
                         of all game actions in a text file named LOGFILE
                         (default: game.log)
+  -R [RECORDFILE], --record [RECORDFILE]
+                        if you supply this flag the referee will create a
+                        compact binary record of the game (which can be
+                        replayed, or rendered as a log, with `python -m
+                        referee.record`) in a file named RECORDFILE (default:
+                        game.rec)
 --------------------------------------------------------------------------------
 """
 
 import argparse
 
+from referee.profiling import ProfileSpec, PROFILERS
+
 # Program information:
 PROGRAM = "referee"
 VERSION = "1.0 (released Apr 12 2019)"
@@ -82,12 +136,26 @@ SPACE_LIMIT_NOVALUE = 100.0 # MB (each)
 TIME_LIMIT_DEFAULT  = 0     # signifying no limit
 TIME_LIMIT_NOVALUE  = 60.0  # seconds (each)
 
+GC_POLICY_DEFAULT = "full"
+PONDER_MODES = ("off", "charged", "free")
+PONDER_DEFAULT = "off"
+SPACE_SAMPLING_DEFAULT = 1 # every call
+
 VERBOSITY_LEVELS  = 4
 VERBOSITY_DEFAULT = 2 # normal level, normal board
 VERBOSITY_NOVALUE = 3 # highest level, debug board
 
+METRICS_DEFAULT = None
+
+PROFILER_DEFAULT = "cprofile"
+PROFILE_PREFIX_DEFAULT = "profile"
+TRACE_DEFAULT = None
+TRACE_NOVALUE = "trace.json"
+
 LOGFILE_DEFAULT = None
 LOGFILE_NOVALUE = "game.log"
+RECORD_DEFAULT = None
+RECORD_NOVALUE = "game.rec"
 
 PKG_SPEC_HELP = """
 The first 3 arguments are 'package specifications'. These specify which Python
@@ -140,14 +208,30 @@ def get_options():
         const=DELAY_NOVALUE,    # if the flag is present with no value
         help="how long (float, seconds) to wait between game turns")
 
-    optionals.add_argument('-s', '--space', metavar="space_limit",
-        type=float, nargs='?',
-        default=SPACE_LIMIT_DEFAULT, const=SPACE_LIMIT_NOVALUE,
-        help="limit on memory space (float, MB) for each player")
-    optionals.add_argument('-t', '--time', metavar="time_limit",
-        type=float, nargs="?",
-        default=TIME_LIMIT_DEFAULT, const=TIME_LIMIT_NOVALUE,
-        help="limit on CPU time (float, seconds) for each player")
+    _add_resource_options(optionals)
+    optionals.add_argument('-p', '--profile', metavar="SPEC",
+        type=profile_spec, action='append', default=[],
+        help="profile the calls to the players selected by %(metavar)s: "
+            "'COLOURS[:TURNS[:METHODS]]', e.g. 'red', 'red,blue:100-200' or "
+            "'all:-50:action' (may be repeated; see referee.profiling) (not "
+            "with --isolate)")
+    optionals.add_argument('--profiler', choices=PROFILERS,
+        default=PROFILER_DEFAULT,
+        help="how to profile the selected calls: 'cprofile' (default; "
+            "writes PREFIX-COLOUR.prof; slows the player's code, which "
+            "counts towards its time) or 'sampling' (writes collapsed "
+            "stacks, PREFIX-COLOUR.folded; its sampling is off the "
+            "clock)")
+    optionals.add_argument('--profile-prefix', metavar="PREFIX",
+        type=str, default=PROFILE_PREFIX_DEFAULT,
+        help="start the names of the profile files with %(metavar)s "
+            "(default: %(default)s)")
+    optionals.add_argument('-T', '--trace', metavar="TRACEFILE",
+        type=str, nargs='?', default=TRACE_DEFAULT, const=TRACE_NOVALUE,
+        help="write a timeline of the game (the referee's work, each call "
+            "to a player, and garbage collection) to a file named "
+            "%(metavar)s, in Chrome's trace event format (default: "
+            "%(const)s)")
 
     optionals.add_argument('-D', '--debug',
         action="store_true",
@@ -166,10 +250,23 @@ def get_options():
         default=LOGFILE_DEFAULT, const=LOGFILE_NOVALUE, metavar="LOGFILE",
         help="if you supply this flag the referee will create a log of all "
         "game actions in a text file named %(metavar)s (default: %(const)s)")
+    optionals.add_argument('-R', '--record',
+        type=str, nargs='?',
+        default=RECORD_DEFAULT, const=RECORD_NOVALUE, metavar="RECORDFILE",
+        help="if you supply this flag the referee will create a compact "
+        "binary record of the game (which can be replayed, or rendered as a "
+        "log, with `python -m referee.record`) in a file named %(metavar)s "
+        "(default: %(const)s)")
 
     args = parser.parse_args()
 
     # resolving any conflicts:
+    if args.ponder != "off":
+        # (players ponder in their own processes: see referee.remote)
+        args.isolate = True
+    if args.profile and args.isolate:
+        # (the profiler can't see into the players' processes)
+        parser.error("--profile can't be used with --isolate (or --ponder)")
     if args.debug:
         args.verbosity = 3
         del args.debug
@@ -179,22 +276,156 @@ def get_options():
         print(WELCOME)
     return args
 
+# tournament program information and defaults:
+
+TOURNAMENT_PROGRAM = "referee.tournament"
+TOURNAMENT_DESCRIP = ("Conducts a tournament of many games of Chexers between "
+    "a set of Player classes, in parallel.")
+
+JOBS_DEFAULT = None # signifying one job per CPU core
+TOURNAMENT_VERBOSITY_LEVELS  = 2
+TOURNAMENT_VERBOSITY_DEFAULT = 1 # one line per game, then the summary
+
+def get_tournament_options():
+    """Parse and return command-line arguments for a tournament."""
+
+    parser = argparse.ArgumentParser(
+        prog=TOURNAMENT_PROGRAM, description=TOURNAMENT_DESCRIP,
+        add_help=False,       # <-- we will add it back to the optional group.
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    positionals = parser.add_argument_group(
+        title="player package/class specifications (positional arguments)",
+        description=PKG_SPEC_HELP)
+    positionals.add_argument('player_locs', metavar='player', nargs='+',
+        help="location of a Player class (e.g. package name). Players take "
+            "turns in each seat (red, green, blue) across the games",
+        action=PackageSpecAction)
+
+    optionals = parser.add_argument_group(title="optional arguments")
+    optionals.add_argument('-h','--help',action='help',help="show this message")
+    optionals.add_argument('-V','--version',action='version', version=VERSION)
+
+    optionals.add_argument('-n', '--games', metavar="games", type=int,
+        default=None,
+        help="how many games to play (default: one for each seating of the "
+            "players)")
+    optionals.add_argument('-j', '--jobs', metavar="jobs", type=int,
+        default=JOBS_DEFAULT,
+        help="how many games to play at once (default: number of CPU cores)")
+    optionals.add_argument('-F', '--fork-server', action="store_true",
+        help="import the players' packages just once, then fork a fresh "
+            "process from there for each game (faster for players with slow "
+            "imports)")
+
+    _add_resource_options(optionals)
+    optionals.add_argument('-R', '--record', metavar="RECORDFILE",
+        type=str, default=RECORD_DEFAULT,
+        help="write a compact binary record of every game (see "
+            "referee.record) to a file named %(metavar)s")
+
+    optionals.add_argument('-v', '--verbosity',
+        type=int, choices=range(0, TOURNAMENT_VERBOSITY_LEVELS),
+        default=TOURNAMENT_VERBOSITY_DEFAULT,
+        help="control the level of output. 0: summary only; 1: (default) "
+            "result of each game as it finishes, then the summary.")
+
+    args = parser.parse_args()
+
+    if args.ponder != "off":
+        args.isolate = True
+    # the games themselves run without any output, delay or log (or
+    # profiling):
+    args.delay = 0
+    args.logfile = None
+    args.profile = []
+    args.profiler = PROFILER_DEFAULT
+    args.profile_prefix = PROFILE_PREFIX_DEFAULT
+    return args
+
+def _add_resource_options(optionals):
+    """
+    Add the options for players' resource limits and measurement (shared by
+    the referee and the tournament) to an argument group.
+    """
+    optionals.add_argument('-s', '--space', metavar="space_limit",
+        type=float, nargs='?',
+        default=SPACE_LIMIT_DEFAULT, const=SPACE_LIMIT_NOVALUE,
+        help="limit on memory space (float, MB) for each player")
+    optionals.add_argument('-t', '--time', metavar="time_limit",
+        type=float, nargs="?",
+        default=TIME_LIMIT_DEFAULT, const=TIME_LIMIT_NOVALUE,
+        help="limit on CPU time (float, seconds) for each player")
+    optionals.add_argument('-g', '--gc', metavar="gc_policy",
+        type=gc_policy, default=GC_POLICY_DEFAULT,
+        help="how to collect garbage before each call to a player (off the "
+            "clock): 'full' (default) collection before every call, 'young' "
+            "(youngest generation only) before every call, or 'every:N' "
+            "(full collection before every Nth call only)")
+    optionals.add_argument('-m', '--space-sampling', metavar="N",
+        type=positive_int, default=SPACE_SAMPLING_DEFAULT,
+        help="measure each player's space usage in full only every N calls "
+            "(or when it seems to have grown), for less overhead (default: "
+            "%(default)s, every call)")
+    optionals.add_argument('-i', '--isolate', action="store_true",
+        help="run each player in a process of its own (measuring each "
+            "player's space usage separately)")
+    optionals.add_argument('-P', '--ponder', choices=PONDER_MODES,
+        default=PONDER_DEFAULT,
+        help="let players with a ponder method think during the other "
+            "players' turns: 'off' (default), 'charged' (pondering counts "
+            "against the player's time limit) or 'free' (it is measured, but "
+            "off the clock) (implies --isolate)")
+    optionals.add_argument('-M', '--metrics', metavar="METRICS",
+        type=str, default=METRICS_DEFAULT,
+        help="write a record of each player's resource usage for each call "
+            "to it to a file named %(metavar)s (as JSON Lines, or CSV if "
+            "%(metavar)s ends with '.csv'; see referee.metrics)")
+
+def positive_int(string):
+    """Check a positive integer, for use as an argparse type."""
+    if string.isdigit() and int(string) > 0:
+        return int(string)
+    raise argparse.ArgumentTypeError(f"invalid positive int value: {string!r}")
+
+def profile_spec(string):
+    """Parse a profiling specification, for use as an argparse type."""
+    try:
+        return ProfileSpec.parse(string)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid profile spec: {string!r} "
+            f"({e})")
+
+def gc_policy(string):
+    """Check a garbage collection policy, for use as an argparse type."""
+    if string in ("full", "young"):
+        return string
+    if string.startswith("every:") and string[len("every:"):].isdigit() \
+            and int(string[len("every:"):]) > 0:
+        return string
+    raise argparse.ArgumentTypeError(f"invalid policy: {string!r} (choose "
+        "from 'full', 'young', or 'every:N' for some N > 0)")
+
 class PackageSpecAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        pkg_spec = values
-        
-        # detect alternative class:
-        if ":" in pkg_spec:
-            pkg, cls = pkg_spec.split(':', maxsplit=1)
+        # save the result in the arguments namespace as a tuple (or as a list
+        # of tuples, for an argument taking multiple package specifications)
+        if isinstance(values, list):
+            setattr(namespace, self.dest, [_parse_pkg_spec(v) for v in values])
         else:
-            pkg = pkg_spec
-            cls = "Player"
+            setattr(namespace, self.dest, _parse_pkg_spec(values))
 
-        # try to convert path to module name
-        mod = pkg.strip("/").replace("/", ".")
-        if mod.endswith(".py"): # NOTE: Assumes submodule is not named `py`.
-            mod = mod[:-3]
+def _parse_pkg_spec(pkg_spec):
+    """Convert a package specification into a (module, class) name pair."""
+    # detect alternative class:
+    if ":" in pkg_spec:
+        pkg, cls = pkg_spec.split(':', maxsplit=1)
+    else:
+        pkg = pkg_spec
+        cls = "Player"
 
-        # save the result in the arguments namespace as a tuple
-        setattr(namespace, self.dest, (mod, cls))
-    
\ No newline at end of file
+    # try to convert path to module name
+    mod = pkg.strip("/").replace("/", ".")
+    if mod.endswith(".py"): # NOTE: Assumes submodule is not named `py`.
+        mod = mod[:-3]
+    return (mod, cls)
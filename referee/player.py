@@ -6,7 +6,16 @@ being executed, etc.
 
 import gc
 import time
+import ctypes
+import signal
+import resource
 import importlib
+import threading
+import contextlib
+
+from referee import remote, profiling
+from referee.remote import RemotePlayer
+from referee.profiling import PlayerProfiler
 
 class PlayerWrapper:
     """
@@ -16,14 +25,37 @@ class PlayerWrapper:
     * `.action()` and `.update()` methods just delegate to the real Player's
       methods of the same name.
     Each method enforces resource limits on the real Player's computation.
+    If `options.isolate`, the real Player runs in a process of its own (see
+    referee.remote), and its resource usage is measured there.
+
+    If `options.ponder` isn't 'off' (and the players are isolated), a real
+    Player with a method `ponder(stop, charged)` gets to think during the
+    other players' turns: after each of its calls but `.action()`, the
+    method runs in a thread of the player's process until the referee next
+    calls on the player, when `stop` (a threading.Event) is set, and it
+    should return promptly. The CPU time it uses goes on the player's clock
+    if `options.ponder` is 'charged' (then `charged` is True), and is just
+    recorded separately if it is 'free'.
+
+    The real Player's calls selected by `options.profile` (ProfileSpecs) are
+    profiled (see referee.profiling), and each call shows up as a span in
+    the game's trace, if there's a `tracer`.
     """
-    def __init__(self, colour, player_loc, options):
+    def __init__(self, colour, player_loc, options, tracer=None):
         self.colour = colour
         self.output = options.verbosity > 0
+        self.isolate = options.isolate
+        self.tracer = tracer
+        self.player = None
         
-        # create some context managers for resource limiting
-        self.timer = _CountdownTimer(options.time, self.colour)
-        self.space = _MemoryWatcher(options.space)
+        # create some context managers for resource limiting (and profiling,
+        # which is kept off the player's clock as far as it can be)
+        self.profiler = PlayerProfiler(self.colour, options.profile,
+            options.profiler, options.profile_prefix)
+        self.timer = _CountdownTimer(options.time, self.colour, options.gc,
+            options.ponder, off_clock=self.profiler.overhead)
+        self.space = _MemoryWatcher(options.space, self.colour,
+            shared=not self.isolate, sampling=options.space_sampling)
         
         # import the Player class from given package
         player_pkg, player_cls = player_loc
@@ -34,32 +66,82 @@ class PlayerWrapper:
     def init(self):
         self._message(f"initialising {self.colour} player as a "
             f"{str(self.Player).strip('<class >')}")
-        with self.space, self.timer:
-            # construct/initialise the player class
-            self.player = self.Player(self.colour)
-        self._message(self.timer.status())
-        self._message(self.space.status())
+        if self.isolate:
+            # construct/initialise the player class in its own process
+            self.player = RemotePlayer(self.colour, self.Player, self.timer,
+                self.space)
+            with self._span("init"):
+                self._remote_call(self.player.init)
+        else:
+            with self._span("init"), self.space, self.timer, \
+                    self.profiler("init"):
+                # construct/initialise the player class
+                self.player = self.Player(self.colour)
+        self._report()
 
     def action(self):
         self._message(f"asking {self.colour} player for next action...")
-        with self.space, self.timer:
-            # ask the real player
-            action = self.player.action()
+        if self.isolate:
+            with self._span("action"):
+                action = self._remote_call(self.player.action)
+        else:
+            with self._span("action"), self.space, self.timer, \
+                    self.profiler("action"):
+                # ask the real player
+                action = self.player.action()
         self._message(f"  {self.colour} player returned action: {action!r}")
-        self._message(self.timer.status())
-        self._message(self.space.status())
+        self._report()
         # give back the result
         return action
 
     def update(self, colour, action):
         self._message(f"updating {self.colour} player with {colour}'s "
             f"action {action}...")
-        with self.space, self.timer:
-            # forward to the real player
-            self.player.update(colour, action)
-        self._message(self.timer.status())
-        self._message(self.space.status())
+        if self.isolate:
+            with self._span("update"):
+                self._remote_call(self.player.update, colour, action)
+        else:
+            with self._span("update"), self.space, self.timer, \
+                    self.profiler("update"):
+                # forward to the real player
+                self.player.update(colour, action)
+        self._report()
+
+    def close(self):
+        """
+        Finish with the player: stop its process (if isolated), and write
+        out its profile (if any of its calls were profiled).
+        """
+        if self.isolate and self.player is not None:
+            self.player.close()
+        path = self.profiler.close()
+        if path is not None:
+            self._message(f"wrote {self.colour} player's profile to {path}")
 
+    def _span(self, method):
+        """A span of the game's trace for a call (if there's a tracer)."""
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(f"{self.colour} {method}", "player",
+            colour=self.colour, method=method)
+
+    def _remote_call(self, method, *args):
+        """
+        Call a method of a RemotePlayer, and account for the resources used
+        by the player's process, as the context managers would have.
+        """
+        budget = self.timer.limit and self.timer.limit - self.timer.clock
+        result, elapsed, space = method(budget, *args)
+        self.timer.charge(elapsed)
+        if space is not None:
+            self.space.check(*space)
+        return result
+
+    def _report(self):
+        """Display the player's latest resource usage (if there's output)."""
+        if self.output:
+            self._message(self.timer.status())
+            self._message(self.space.status())
     def _message(self, message):
         if self.output and message:
             print("*", message)
@@ -86,39 +168,175 @@ class _CountdownTimer:
     * measures CPU time, not wall-clock time
     * if limit is not 0, throws an exception upon exiting the context after the 
       allocated time has passed
+    * if limit is not 0, also interrupts the code inside the context as soon
+      as the allocated time has passed (where possible; see _start_alarm)
+    * cleans up memory upon entering the context, off the clock (see
+      _GarbageCollector)
+    * also accounts for the time the player spends pondering (see
+      PlayerWrapper), on or off the clock
+    * leaves off the clock the referee's own work inside the context, as
+      measured by `off_clock` (e.g. profiling: see PlayerProfiler.overhead)
     """
-    def __init__(self, limit, colour):
+    def __init__(self, limit, colour, gc_policy="full", ponder="off",
+            off_clock=None):
         """
         Create a new countdown timer with time limit `limit`, in seconds
-        (0 for unlimited time)
+        (0 for unlimited time), collecting garbage under policy `gc_policy`,
+        and accounting for pondering under mode `ponder`. If given,
+        `off_clock` returns the CPU time (s) used so far for work to leave
+        off the clock
         """
         self.colour = colour
+        self.off_clock = off_clock or (lambda: 0.0)
         self.limit = limit
         self.clock = 0
-        self._status = ""
-    def _set_status(self, status):
-        self._status = status
+        self.gc = _GarbageCollector(gc_policy)
+        self.ponder_mode = ponder
+        self.ponder_clock = 0
+        self.elapsed = None # (for the latest call, once there has been one)
     def status(self):
-        return self._status
+        """Describe the time used so far, for display."""
+        if self.elapsed is None:
+            return ""
+        status = (f"  time:  +{self.elapsed:6.3f}s  (just elapsed)  "
+            f"{self.clock:7.3f}s  (game total)  {self.gc.clock:7.3f}s  "
+            "(gc total, off the clock)")
+        if self.ponder_mode == "charged":
+            status += f"  {self.ponder_clock:7.3f}s  (pondered, in total)"
+        elif self.ponder_mode == "free":
+            status += (f"  {self.ponder_clock:7.3f}s  (pondered, off the "
+                "clock)")
+        return status
     
     def __enter__(self):
         # clean up memory off the clock
-        gc.collect()
+        self.gc.collect()
         # then start timing
         self.start = time.process_time()
+        self.off_start = self.off_clock()
+        if self.limit:
+            _start_alarm(self.limit - self.clock)
         return self # unused
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        # accumulate elapsed time since __enter__
-        elapsed = time.process_time() - self.start
+        if self.limit:
+            _stop_alarm()
+        # accumulate elapsed time since __enter__ (but for any work off the
+        # clock)
+        off = self.off_clock() - self.off_start
+        self.charge(time.process_time() - self.start - off)
+        # (the alarm and the clock might disagree by a hair)
+        if exc_type is _OutOfTime:
+            self.timeout()
+
+    def timeout(self):
+        """Throw the exception for running out of time."""
+        raise ResourceLimitException(f"{self.colour} player exceeded "
+            "available time")
+
+    def charge(self, elapsed):
+        """
+        Add `elapsed` seconds to the clock (throwing an exception if this
+        exceeds the limit)
+        """
         self.clock += elapsed
-        self._set_status(f"  time:  +{elapsed:6.3f}s  (just elapsed)  "
-            f"{self.clock:7.3f}s  (game total)")
+        self.elapsed = elapsed
 
         # if we are limited, let's hope we aren't out of time!
         if self.limit and self.clock > self.limit:
-            raise ResourceLimitException(f"{self.colour} player exceeded "
-                "available time")
+            self.timeout()
+
+    def ponder(self, elapsed):
+        """
+        Record `elapsed` seconds spent pondering, also adding them to the
+        clock (see charge) if pondering is charged
+        """
+        self.ponder_clock += elapsed
+        if self.ponder_mode == "charged":
+            self.charge(elapsed)
+
+
+class _GarbageCollector:
+    """
+    Cleans up memory before each of a player's calls, according to a policy:
+
+    * 'full': a full collection before every call (the default)
+    * 'young': a collection of only the youngest generation before every call
+      (much faster if the player keeps lots of long-lived objects, like a
+      large transposition table)
+    * 'every:N': a full collection before every Nth call only
+
+    and keeps track of how long this takes (in CPU time), separately from the
+    time charged to the player.
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.period = 1
+        if policy.startswith("every:"):
+            self.period = int(policy[len("every:"):])
+        self.generation = 0 if policy == "young" else 2
+        self.ncalls = 0
+        self.clock = 0
+        self.elapsed = 0 # (for the latest collection)
+    def collect(self):
+        start = time.process_time()
+        if self.ncalls % self.period == 0:
+            gc.collect(self.generation)
+        self.ncalls += 1
+        elapsed = time.process_time() - start
+        self.record(elapsed)
+        return elapsed
+    def record(self, elapsed):
+        """Add `elapsed` seconds to the time spent collecting"""
+        self.clock += elapsed
+        self.elapsed = elapsed
+
+
+class _OutOfTime(BaseException):
+    """
+    Raised inside a player's code when its time runs out. This is not an
+    Exception, so that it gets past any `except Exception:` in the player.
+    """
+
+# while the alarm is armed, every _ALARM_REPEAT seconds of CPU time after the
+# first _OutOfTime, raise another (in case the player caught the first one)
+_ALARM_REPEAT = 0.05
+_alarm_armed = False
+def _start_alarm(budget):
+    """
+    Arrange for _OutOfTime to be raised once this process has used `budget`
+    more seconds of CPU time (until _stop_alarm is called).
+
+    NOTE: This only works in the main thread (signal handlers always run
+    there), and the exception can only be raised between Python bytecodes,
+    not in the middle of a long-running call to native code.
+    """
+    global _alarm_armed
+    if threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGPROF, _out_of_time)
+    _alarm_armed = True
+    signal.setitimer(signal.ITIMER_PROF, max(budget, 1e-6), _ALARM_REPEAT)
+def _stop_alarm():
+    global _alarm_armed
+    if _alarm_armed:
+        # (with the signal blocked, so that it can't go off half way)
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGPROF})
+        _alarm_armed = False
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+def _out_of_time(signum, frame):
+    # (a signal may arrive after the alarm is stopped, but not be handled until
+    # after that, when it should be ignored. Likewise, a signal arriving once
+    # the player's call has returned, on the way out to _stop_alarm, would
+    # raise _OutOfTime out of the referee's own code, where nothing converts
+    # it: the call is charged for its time, and times out, all the same.)
+    if _alarm_armed and frame.f_code.co_filename not in _TIMING_FILES:
+        raise _OutOfTime()
+# the files of the code around the player's timed calls (see PlayerWrapper
+# and referee.remote._serve)
+_TIMING_FILES = {__file__, remote.__file__, profiling.__file__,
+    contextlib.__file__}
 
 
 class _MemoryWatcher:
@@ -129,14 +347,26 @@ class _MemoryWatcher:
     * works by parsing procfs; only available on linux.
     * unless the limit is set to 0, throws an exception upon exiting the
       context if the memory limit has been breached
+    * if `shared`, the measurements are of the process shared by all three
+      players, so they are checked against triple the limit
+    * measurements are taken by a _SpaceSampler (reading procfs only every
+      `sampling` calls, or when there are signs of growth)
     """
-    def __init__(self, space_limit):
+    def __init__(self, space_limit, colour, shared=True, sampling=1):
         self.limit = space_limit
-        self._status = ""
-    def _set_status(self, status):
-        self._status = status
+        self.colour = colour
+        self.shared = shared
+        self.sampler = _SpaceSampler(sampling)
+        # the latest (current, peak, resident) usage, once measured
+        self.usage = None
     def status(self):
-        return self._status
+        """Describe the latest space usage, for display."""
+        if self.usage is None:
+            return ""
+        curr_usage, peak_usage, rss_usage = self.usage
+        return (f"  space: {curr_usage:7.3f}MB (current usage) "
+            f"{peak_usage:7.3f}MB (max usage) {rss_usage:7.3f}MB "
+            "(resident)" + (" (shared)" if self.shared else ""))
     
     def __enter__(self):
         return self # unused
@@ -145,49 +375,95 @@ class _MemoryWatcher:
         Check up on the current and peak space usage of the process, printing
         stats and ensuring that peak usage is not exceeding limits
         """
-        if _SPACE_ENABLED:
-            curr_usage, peak_usage = _get_space_usage()
-    
-            # adjust measurements to reflect usage of players and referee, not
-            # the Python interpreter itself
-            curr_usage -= _DEFAULT_MEM_USAGE
-            peak_usage -= _DEFAULT_MEM_USAGE
-
-            self._set_status(f"  space: {curr_usage:7.3f}MB (current usage) "
-                f"{peak_usage:7.3f}MB (max usage) (shared)")
+        space = self.sampler.sample()
+        if space is not None:
+            self.check(*space)
 
+    def check(self, curr_usage, peak_usage, rss_usage):
+        """
+        Record the current and peak (virtual memory) space usage and resident
+        set size (in MB), ensuring that peak usage is not exceeding limits
+        """
+        self.usage = (curr_usage, peak_usage, rss_usage)
+        if self.shared:
             # if we are limited, let's hope we are not out of space!
             # triple the limit because space usage is shared
             if self.limit and peak_usage > 3 * self.limit:
                 raise ResourceLimitException("players exceeded shared space "
                     "limit")
+        else:
+            if self.limit and peak_usage > self.limit:
+                raise ResourceLimitException(f"{self.colour} player exceeded "
+                    "available space")
+
+class _SpaceSampler:
+    """
+    Measures the space usage of the current process, relative to the
+    baseline recorded by `set_space_line`. Parsing procfs is relatively
+    expensive, so this can be done only every `every` calls to `sample`,
+    unless a cheap check (of the peak resident set size, using getrusage)
+    shows that the process has grown since the last time. Otherwise, the
+    last measurement is repeated.
+
+    NOTE: The peak virtual memory usage (which limits are checked against)
+    is a high-water mark, so limits breached between samples are still
+    caught, just slightly later.
+    """
+    def __init__(self, every=1):
+        self.every = every
+        self.ncalls = 0
+        self.max_rss = 0
+        self.last = None
+    def sample(self):
+        """
+        Return the current and peak virtual memory usage and the resident set
+        size, in MB (or None if these can't be measured on this platform).
+        """
+        if not _SPACE_ENABLED:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.ncalls % self.every == 0 or max_rss > self.max_rss:
+            curr_usage, peak_usage, rss_usage = _get_space_usage()
+
+            # adjust measurements to reflect usage of players and referee, not
+            # the Python interpreter itself
+            self.last = (curr_usage - _DEFAULT_MEM_USAGE,
+                peak_usage - _DEFAULT_MEM_USAGE,
+                rss_usage - _DEFAULT_RSS_USAGE)
+            self.max_rss = max_rss
+        self.ncalls += 1
+        return self.last
 
 def _get_space_usage():
     """
-    Find the current and peak Virtual Memory usage of the current process, in MB
+    Find the current and peak Virtual Memory usage, and the Resident Set Size,
+    of the current process, in MB
     """
     # on linux, we can find the memory usage of our program we are looking for 
-    # inside /proc/self/status (specifically, fields VmSize and VmPeak)
+    # inside /proc/self/status (specifically, fields VmSize, VmPeak and VmRSS)
     with open("/proc/self/status") as proc_status:
         for line in proc_status:
             if 'VmSize:' in line:
                 curr_usage = int(line.split()[1]) / 1024 # kB -> MB
             elif 'VmPeak:' in line:
                 peak_usage = int(line.split()[1]) / 1024 # kB -> MB
-    return curr_usage, peak_usage
+            elif 'VmRSS:' in line:
+                rss_usage = int(line.split()[1]) / 1024 # kB -> MB
+    return curr_usage, peak_usage, rss_usage
 
 
 _DEFAULT_MEM_USAGE = 0
+_DEFAULT_RSS_USAGE = 0
 _SPACE_ENABLED = False
 def set_space_line():
     """
     by default, the python interpreter uses a significant amount of space
     measure this first to later subtract from all measurements
     """
-    global _SPACE_ENABLED, _DEFAULT_MEM_USAGE
+    global _SPACE_ENABLED, _DEFAULT_MEM_USAGE, _DEFAULT_RSS_USAGE
     
     try:
-        _DEFAULT_MEM_USAGE, _ = _get_space_usage()
+        _DEFAULT_MEM_USAGE, _, _DEFAULT_RSS_USAGE = _get_space_usage()
         _SPACE_ENABLED = True
     except:
         # this also gives us a chance to detect if our space-measuring method 
@@ -195,3 +471,37 @@ def set_space_line():
         print("* NOTE: unable to measure memory usage on this platform "
             "(try dimefox)")
         _SPACE_ENABLED = False
+
+# (mallopt's parameter number for the maximum number of malloc arenas)
+_M_ARENA_MAX = -8
+def share_malloc_arena():
+    """
+    Have all threads allocate memory from the main thread's arena. Otherwise,
+    glibc reserves a 64MB arena for each new thread that allocates memory,
+    which would count towards the virtual memory usage that space limits are
+    checked against (the referee's own threads should count for nothing).
+    """
+    try:
+        ctypes.CDLL(None).mallopt(_M_ARENA_MAX, 1)
+    except (OSError, AttributeError):
+        pass # (not glibc)
+
+# the stack size of the referee's background threads (they need very little)
+_THREAD_STACK_SIZE = 256 * 1024
+def start_referee_thread(target, stack_size=_THREAD_STACK_SIZE):
+    """
+    Start (and return) a daemon thread running `target`, for the referee's
+    own work in the background. The thread is set up to count for as little
+    as possible towards the players' space usage, when they share the
+    referee's process: it shares the main thread's malloc arena (see
+    share_malloc_arena), and has a small stack (unless given `stack_size`,
+    in bytes, or 0 for the platform's default).
+    """
+    share_malloc_arena()
+    stack_size = threading.stack_size(stack_size)
+    try:
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+    finally:
+        threading.stack_size(stack_size)
+    return thread
@@ -0,0 +1,289 @@
+"""
+Profiling for the referee and its players: a profiler for selected calls to
+a player (see PlayerProfiler), to see where a slow player's time goes, and
+a timeline of a whole game (see Tracer), to see where the referee's time
+goes, in Chrome's trace event format.
+
+Profiles are written for each player, as '{prefix}-{colour}.prof' (cProfile
+statistics: see the pstats module, or any viewer for them), or with the
+sampling profiler, as '{prefix}-{colour}.folded' (collapsed stacks, one per
+line with its number of samples, for flame graph tools).
+
+Traces can be viewed with chrome://tracing, or https://ui.perfetto.dev.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import threading
+import contextlib
+from collections import Counter
+
+PROFILERS = ("cprofile", "sampling")
+METHODS = ("init", "action", "update")
+# the sampling profiler samples the player's stack every this long (s) (over
+# the player's calls: see _Sampler)
+_SAMPLE_INTERVAL = 0.001
+
+
+class ProfileSpec:
+    """
+    Which calls to profile: calls to methods in `methods` (of METHODS) of
+    the players with colours in `colours`, at turns `first` to `last`
+    (inclusive; None for no bound). A call's turn is the number of turns
+    taken in the game before the call (as in referee.metrics).
+    """
+    def __init__(self, colours, first=None, last=None, methods=METHODS):
+        self.colours = colours
+        self.first = first
+        self.last = last
+        self.methods = methods
+    def __repr__(self):
+        return (f"ProfileSpec({self.colours!r}, {self.first!r}, "
+            f"{self.last!r}, {self.methods!r})")
+
+    def selects(self, colour, method, turn):
+        return colour in self.colours and method in self.methods \
+            and (self.first is None or turn >= self.first) \
+            and (self.last is None or turn <= self.last)
+
+    @classmethod
+    def parse(cls, string):
+        """
+        Parse a specification 'COLOURS[:TURNS[:METHODS]]', where COLOURS is
+        a comma-separated list of colours (or initials), or 'all'; TURNS is
+        a turn 'N', or a range 'N-M' (either end of which may be left out),
+        or 'all'; and METHODS is a comma-separated list of METHODS, or
+        'all'. For example: 'red:100-200:action', or 'all:-50'. Raise
+        ValueError if it's not valid.
+        """
+        parts = string.split(":")
+        if len(parts) > 3:
+            raise ValueError("too many parts")
+        colours, turns, methods = parts + ["all"] * (3 - len(parts))
+
+        names = {"r": "red", "g": "green", "b": "blue"}
+        if colours == "all":
+            colours = names.values()
+        else:
+            colours = [names.get(c.strip(), c.strip())
+                for c in colours.split(",")]
+            if not all(c in names.values() for c in colours):
+                raise ValueError("colours must be red, green or blue")
+
+        first = last = None
+        if turns not in ("all", ""):
+            bounds = turns.split("-")
+            if len(bounds) > 2 or not all(b.isdigit() or b == ""
+                    for b in bounds) or bounds == ["", ""]:
+                raise ValueError(f"invalid turns: {turns!r}")
+            first = int(bounds[0]) if bounds[0] else None
+            last = int(bounds[-1]) if bounds[-1] else None
+
+        if methods == "all":
+            methods = METHODS
+        else:
+            methods = [m.strip() for m in methods.split(",")]
+            if not all(m in METHODS for m in methods):
+                raise ValueError(f"methods must be in {', '.join(METHODS)}")
+        return cls(frozenset(colours), first, last, tuple(methods))
+
+
+class PlayerProfiler:
+    """
+    Profile a player's calls selected by any of `specs` (ProfileSpecs), with
+    a profiler from PROFILERS, to write out (see close) to files named for
+    `prefix`. Wrap each call to the player in `profiler(method)`. The
+    profiler counts the turns itself: the player is called on to update
+    once per turn.
+    """
+    def __init__(self, colour, specs, profiler="cprofile", prefix="profile"):
+        self.colour = colour
+        self.specs = [spec for spec in specs if colour in spec.colours]
+        self.kind = profiler
+        self.prefix = prefix
+        self.turn = 0
+        self.ncalls = 0 # (profiled)
+        self.profile = self.sampler = None
+        # (set up now, rather than during the player's first profiled call)
+        if self.specs and profiler == "cprofile":
+            self.profile = cProfile.Profile()
+        elif self.specs:
+            self.sampler = _Sampler()
+
+    def __call__(self, method):
+        """A context manager profiling a call to `method` (if selected)."""
+        if method == "update":
+            # (the turn has been taken by the time the player hears of it)
+            self.turn += 1
+        if not any(spec.selects(self.colour, method, self.turn)
+                for spec in self.specs):
+            return contextlib.nullcontext()
+        self.ncalls += 1
+        return self.profile or self.sampler
+
+    def overhead(self):
+        """
+        The CPU time (s) spent profiling so far, as far as it can be
+        measured: the sampling profiler's sampling. (cProfile's overhead is
+        spread through the profiled code, slowing it down.)
+        """
+        return self.sampler.overhead if self.sampler is not None else 0.0
+
+    def path(self):
+        """The file the profile is written to."""
+        extension = ".prof" if self.kind == "cprofile" else ".folded"
+        return f"{self.prefix}-{self.colour}{extension}"
+
+    def close(self):
+        """
+        Write out the profile (if any calls were profiled), returning the
+        path it was written to (or None).
+        """
+        if self.ncalls == 0:
+            return None
+        if self.profile is not None:
+            self.profile.dump_stats(self.path())
+        else:
+            with open(self.path(), 'w') as f:
+                for stack, count in self.sampler.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        return self.path()
+
+class _Sampler:
+    """
+    A sampling profiler: while entered (as a context manager), the stack of
+    the (main) thread entering it is sampled every _SAMPLE_INTERVAL, by a
+    SIGALRM timer, counting each distinct stack (collapsed into a string,
+    outermost frame first). The CPU time spent sampling is kept in
+    `overhead`.
+
+    The sampling clock runs on from one call to the next (a call ending
+    partway through an interval leaves the rest of it to the next call), so
+    that even calls much shorter than the interval are sampled, in
+    proportion to the time they take.
+
+    NOTE: The clock is wall-clock time, since the operating system's CPU
+    time timers only fire on the scheduler's ticks (every few ms), which
+    short calls mostly miss. The player's calls are timed by CPU time, but
+    they take about as long by the wall clock, unless the player sleeps.
+    """
+    def __init__(self):
+        self.samples = Counter()
+        self.overhead = 0.0
+        # the time carried over from earlier calls towards the next sample,
+        # and when the current call was last sampled (if it has been)
+        self._carried = 0.0
+        self._sampled = None
+        # (the handler is shared by every player's sampler, and left
+        # installed, so that a signal arriving just after a call is
+        # ignored, rather than ending the process)
+        signal.signal(signal.SIGALRM, _on_sample)
+
+    def __enter__(self):
+        global _sampling
+        _sampling = self
+        self._sampled = None
+        self._start = time.perf_counter()
+        signal.setitimer(signal.ITIMER_REAL,
+            max(_SAMPLE_INTERVAL - self._carried, 1e-6), _SAMPLE_INTERVAL)
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _sampling
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _sampling = None
+        now = time.perf_counter()
+        if self._sampled is None:
+            # (a sample due at the very end of the call may have been
+            # missed, but it isn't carried over to the next)
+            self._carried = (self._carried + now - self._start) \
+                % _SAMPLE_INTERVAL
+        else:
+            self._carried = now - self._sampled
+
+    def sample(self, frame):
+        """Count the stack from `frame` out."""
+        start = time.process_time()
+        self._sampled = time.perf_counter()
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} "
+                f"({os.path.basename(code.co_filename)}:"
+                f"{code.co_firstlineno})")
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+        self.overhead += time.process_time() - start
+
+# the sampler currently entered (if any)
+_sampling = None
+def _on_sample(signum, frame):
+    # (samples caught on the way into or out of a call are the sampler's)
+    if _sampling is not None and frame.f_code.co_filename != __file__:
+        _sampling.sample(frame)
+
+
+class Tracer:
+    """
+    Record a timeline of a game, to write out (see close) to a file at
+    `path` as a Chrome trace: spans (see span) of the referee's work and of
+    the calls to the players, on the thread they ran on, and of every
+    garbage collection (from the moment the tracer is created).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = [{"name": "process_name", "ph": "M", "pid": self.pid,
+            "args": {"name": "referee"}}]
+        self._threads = set()
+        self._start = time.perf_counter_ns()
+        self._collections = {} # thread -> start of its current collection
+        gc.callbacks.append(self._gc)
+
+    def _now(self):
+        """The time since the trace started, in microseconds."""
+        return (time.perf_counter_ns() - self._start) / 1000
+
+    def _thread(self):
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            self._threads.add(tid)
+            self.events.append({"name": "thread_name", "ph": "M",
+                "pid": self.pid, "tid": tid,
+                "args": {"name": threading.current_thread().name}})
+        return tid
+
+    def _add(self, name, category, start, args):
+        self.events.append({"name": name, "cat": category, "ph": "X",
+            "ts": start, "dur": self._now() - start, "pid": self.pid,
+            "tid": self._thread(), "args": args})
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """A context manager recording its body as a span."""
+        start = self._now()
+        try:
+            yield
+        finally:
+            self._add(name, category, start, args)
+
+    def _gc(self, phase, info):
+        tid = threading.get_native_id()
+        if phase == "start":
+            self._collections[tid] = self._now()
+        elif tid in self._collections:
+            self._add(f"gc (generation {info['generation']})", "gc",
+                self._collections.pop(tid), {"collected":
+                info['collected'], "uncollectable": info['uncollectable']})
+
+    def close(self):
+        """Stop tracing, and write out the trace."""
+        if self._gc in gc.callbacks:
+            gc.callbacks.remove(self._gc)
+        with open(self.path, 'w') as f:
+            json.dump({"traceEvents": self.events,
+                "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,272 @@
+"""
+A compact binary format for records of Chexers games, and a replay engine
+which can jump straight to any turn of any game in a record file.
+
+A record file is a sequence of game records, each made up of:
+* a header (see _GAME): a magic tag, the game's number (in a tournament),
+  when it started, how many actions and checkpoints follow, and its result;
+* its actions, two bytes each: the action type (two bits) and the numbers of
+  the two cells involved (six bits each, 63 for an unused cell). Players
+  take turns in order, so the colour of each action is implied;
+* its checkpoints (see _CHECKPOINT), one every CHECKPOINT_INTERVAL turns:
+  the turn number, the pieces on the board and the scores after that turn,
+  and when the last irreversible action (see Chexers._turn_detect_draw)
+  before it was taken.
+
+Each game is written in one go, when it ends, so several processes (e.g.
+the games of a tournament) can append games to the same file. The game log
+(see Chexers._log) is a rendering of a game's record: see GameReplay.log.
+
+Run `python -m referee.record FILE` to print the log of each game in a
+record file (see `--help`), or of one game, or to show a game's board at
+any turn.
+"""
+
+import os
+import sys
+import mmap
+import time
+import bisect
+import struct
+import argparse
+
+from referee.log import log_line
+from referee.game import Chexers, describe_action, move_to_action
+from referee.game import pack_move, unpack_move
+
+# a checkpoint every this many turns (so replaying to any turn takes at most
+# this many actions, give or take the state history: see GameReplay.game)
+CHECKPOINT_INTERVAL = 32
+
+_GAME_MAGIC = b"CHXG"
+# magic, game number (NO_NUMBER for none), start time (time.time()), number
+# of actions, number of checkpoints, result (see UNFINISHED)
+_GAME = struct.Struct("<4sIdHHB3x")
+# turn number, turn number of the last irreversible action (0 for none),
+# scores (r, g, b), cell masks (r, g, b)
+_CHECKPOINT = struct.Struct("<HH3Bx3Q")
+_ACTION = struct.Struct("<H")
+NO_NUMBER = 0xFFFFFFFF
+
+_COLOURS = "rgb"
+_COLOUR_NAMES = ["red", "green", "blue"]
+
+# Results: unfinished (e.g. stopped by a resource limit), won by a colour,
+# drawn (by each of Chexers' draw messages), or stopped by an illegal action
+# by a colour
+UNFINISHED = 0
+_WON = 1 # + colour index
+_DRAWN = 4 # + index into _DRAW_MESSAGES
+_ILLEGAL = 6 # + colour index
+_DRAW_MESSAGES = ["maximum number of turns reached.",
+    "game state occurred 4 times."]
+
+
+class GameRecorder:
+    """
+    Record a game into a record file at `path` (see Chexers, which adds
+    each action as it is applied), as game number `number` (or None).
+
+    Unless `append`, the file is started afresh. Otherwise the game is
+    added to the end of it.
+    """
+    def __init__(self, path, number=None, append=False):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not append:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o644)
+        self.number = NO_NUMBER if number is None else number
+        self.start = time.time()
+        self.actions = bytearray()
+        self.checkpoints = bytearray()
+        self.ncheckpoints = 0
+        self.last_irreversible = 0
+        self.result = UNFINISHED
+
+    def add(self, game, move, irreversible):
+        """Record a move just applied to `game` (and whether irreversible)."""
+        self.actions += _ACTION.pack(pack_move(move))
+        if irreversible:
+            self.last_irreversible = game.nturns
+        if game.nturns % CHECKPOINT_INTERVAL == 0:
+            pieces, score = game.board.pieces, game.score
+            self.checkpoints += _CHECKPOINT.pack(game.nturns,
+                self.last_irreversible, score['r'], score['g'], score['b'],
+                pieces['r'], pieces['g'], pieces['b'])
+            self.ncheckpoints += 1
+
+    def illegal(self, col):
+        """Record that the game stopped for an illegal action by `col`."""
+        self.result = _ILLEGAL + _COLOURS.index(col)
+
+    def close(self, game):
+        """Write out the record of `game`, however far it got."""
+        if self._fd is None:
+            return
+        if self.result == UNFINISHED and game.over():
+            if game.drawmsg:
+                self.result = _DRAWN + _DRAW_MESSAGES.index(game.drawmsg)
+            else:
+                winner = max(_COLOURS, key=game.score.get)
+                self.result = _WON + _COLOURS.index(winner)
+        header = _GAME.pack(_GAME_MAGIC, self.number, self.start,
+            len(self.actions) // _ACTION.size, self.ncheckpoints, self.result)
+        data = header + self.actions + self.checkpoints
+        while data:
+            data = data[os.write(self._fd, data):]
+        os.close(self._fd)
+        self._fd = None
+
+
+class GameRecords:
+    """
+    A record file, memory-mapped for replaying: a sequence of GameReplays
+    (index it by position in the file), found by skipping from header to
+    header, without reading the games themselves.
+    """
+    def __init__(self, path):
+        self.map = None
+        self.offsets = []
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return # (an empty file can't be mapped)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = 0
+        while offset + _GAME.size <= len(self.map):
+            magic, _, _, nactions, ncheckpoints, _ = _GAME.unpack_from(
+                self.map, offset)
+            if magic != _GAME_MAGIC:
+                raise ValueError(f"{path} is not a valid record file (at "
+                    f"byte {offset})")
+            self.offsets.append(offset)
+            offset += _GAME.size + nactions * _ACTION.size \
+                + ncheckpoints * _CHECKPOINT.size
+        if offset != len(self.map):
+            raise ValueError(f"{path} is truncated")
+
+    def __len__(self):
+        return len(self.offsets)
+    def __getitem__(self, i):
+        return GameReplay(self.map, self.offsets[i])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+class GameReplay:
+    """
+    The record of one game (in a memory-mapped record file), from which to
+    replay the game to any turn (see game), or render its log (see log).
+    """
+    def __init__(self, data, offset):
+        self.data = data
+        (_, number, self.start, self.nactions, self.ncheckpoints,
+            self.result) = _GAME.unpack_from(data, offset)
+        self.number = None if number == NO_NUMBER else number
+        self._actions = offset + _GAME.size
+        self._checkpoints = self._actions + self.nactions * _ACTION.size
+        # (the turn of each checkpoint, for finding them by bisection)
+        self._turns = [self._checkpoint(i)[0]
+            for i in range(self.ncheckpoints)]
+
+    def move(self, i):
+        """The move (see Chexers.moves) of action number i (from 0)."""
+        code, = _ACTION.unpack_from(self.data, self._actions + i * _ACTION.size)
+        return unpack_move(code)
+
+    def _checkpoint(self, i):
+        return _CHECKPOINT.unpack_from(self.data,
+            self._checkpoints + i * _CHECKPOINT.size)
+    def _restore(self, turn, exact_history):
+        """A game at the last checkpoint at or before `turn` (or the start)."""
+        i = bisect.bisect_right(self._turns, turn) - 1
+        if i < 0:
+            return Chexers(None, exact_history)
+        nturns, _, r, g, b, *masks = self._checkpoint(i)
+        return Chexers.from_position(dict(zip(_COLOURS, masks)),
+            {'r': r, 'g': g, 'b': b}, nturns, exact_history)
+
+    def game(self, turn=None, history=True, exact_history=False):
+        """
+        A referee Chexers game (without a log) at the given turn (the state
+        after that many actions; by default, the end of the game), replayed
+        from the nearest checkpoint.
+
+        If `history`, the game's state history is complete, so that its draw
+        detection carries on exactly as in the original game: then the
+        replay starts from the nearest checkpoint at or before the last
+        irreversible action (which cleared the history).
+        """
+        if turn is None:
+            turn = self.nactions
+        if not 0 <= turn <= self.nactions:
+            raise IndexError(f"turn {turn} is not in the game (which has "
+                f"{self.nactions} actions)")
+        start = turn
+        if history:
+            i = bisect.bisect_right(self._turns, turn) - 1
+            start = self._checkpoint(i)[1] if i >= 0 else 0
+        game = self._restore(start, exact_history)
+        for i in range(game.nturns, turn):
+            game.make_move(self.move(i))
+        return game
+
+    def result_message(self):
+        """The result of the game, as the referee describes it (or None)."""
+        if self.result == UNFINISHED:
+            return None
+        if self.result < _DRAWN:
+            return f"winner: {_COLOUR_NAMES[self.result - _WON].title()}"
+        if self.result < _ILLEGAL:
+            return f"draw detected: {_DRAW_MESSAGES[self.result - _DRAWN]}"
+        return (f"illegal action detected "
+            f"({_COLOUR_NAMES[self.result - _ILLEGAL]}).")
+
+    def log(self):
+        """
+        Generate the lines of the game's log, as Chexers would have logged
+        it (except that illegal actions themselves aren't recorded).
+        """
+        yield log_line("game", "Start Chexers game log at",
+            time.asctime(time.localtime(self.start)))
+        for i in range(self.nactions):
+            yield log_line(_COLOUR_NAMES[i % 3],
+                describe_action(move_to_action(self.move(i))))
+        result = self.result_message()
+        if result is not None:
+            yield log_line("error" if self.result >= _ILLEGAL else "over",
+                result)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="referee.record",
+        description="Print the log of each game in a Chexers record file, or "
+            "of one game, or show a game's board at a turn.")
+    parser.add_argument('path', help="the record file")
+    parser.add_argument('-g', '--game', type=int, default=None,
+        help="just this game (by position in the file, from 0)")
+    parser.add_argument('-t', '--turn', type=int, default=None,
+        help="show the game's board after this many turns (needs --game)")
+    parser.add_argument('-D', '--debug', action="store_true",
+        help="show the debug board (with coordinates)")
+    args = parser.parse_args()
+
+    records = GameRecords(args.path)
+    try:
+        if args.turn is not None:
+            if args.game is None:
+                parser.error("--turn needs --game")
+            game = records[args.game].game(args.turn)
+            print(game.display(debug=args.debug))
+            return
+        games = range(len(records)) if args.game is None else [args.game]
+        for i in games:
+            for line in records[i].log():
+                print(line)
+    except IndexError as e:
+        sys.exit(f"error: {e}")
+    finally:
+        records.close()
+
+if __name__ == '__main__':
+    main()
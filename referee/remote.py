@@ -0,0 +1,354 @@
+"""
+Provide a way to run a Player class in a process of its own, so that each
+player's time and space usage can be measured separately (and so that one
+misbehaving player can't interfere with the referee or the other players).
+
+The referee talks to each player's process over a pipe, with a compact binary
+encoding of requests, actions and resource usage.
+"""
+
+import gc
+import time
+import math
+import signal
+import struct
+import pickle
+import resource
+import threading
+import traceback
+import multiprocessing
+
+from referee.board import CELL_INDEX
+from referee.game import action_to_move, move_to_action
+from referee.game import pack_move, unpack_move
+
+# Compact binary encoding of actions:
+# A well-formed action packs into two bytes: its move's code (see
+# referee.game.pack_move), big-endian, so that the first byte is never
+# _OTHER. Anything else the player returns is pickled instead, after that
+# marker byte, so that the referee still gets to see (and reject) exactly
+# what the player returned.
+
+_MOVE = struct.Struct(">H")
+_OTHER = 0xFF
+
+def pack_action(action):
+    """Encode an action (or anything else a player returned) as bytes."""
+    if isinstance(action, tuple) and len(action) == 2:
+        atype, aargs = action
+        try:
+            if atype in ("MOVE", "JUMP") and _is_pair(aargs) \
+                    and _is_pair(aargs[0]) and _is_pair(aargs[1]) \
+                    and aargs[0] in CELL_INDEX and aargs[1] in CELL_INDEX \
+                    or atype == "EXIT" and _is_pair(aargs) \
+                    and aargs in CELL_INDEX \
+                    or atype == "PASS" and aargs is None:
+                return _MOVE.pack(pack_move(action_to_move(action)))
+        except TypeError: # e.g. unhashable coordinates
+            pass
+    try:
+        return bytes((_OTHER,)) + pickle.dumps(action)
+    except Exception: # can't be pickled, but at least we can show it
+        return bytes((_OTHER,)) + pickle.dumps(repr(action))
+def unpack_action(data):
+    """Decode an action encoded by `pack_action`."""
+    if data[0] == _OTHER:
+        return pickle.loads(data[1:])
+    return move_to_action(unpack_move(_MOVE.unpack_from(data)[0]))
+def _is_pair(x):
+    return isinstance(x, tuple) and len(x) == 2
+
+
+# Requests (referee to player process) are a one-byte code and the player's
+# remaining time budget (see _BUDGET), followed (for an update) by one byte
+# for the colour and an encoded action.
+# Replies (player process to referee) are a one-byte status, then:
+# * if the call went well (or was interrupted for running out of time), the
+#   CPU time it took (and that collecting garbage before it took, and that
+#   the player spent pondering since its last call) and the space usage of
+#   the player's process (see _USAGE), followed (for an action) by the
+#   encoded action;
+# * if the player raised an exception, the exception (pickled if possible).
+
+_INIT, _ACTION, _UPDATE, _QUIT = b'IAUQ'
+_OK, _TIMEOUT, _ERROR = b'KTE'
+_BUDGET = struct.Struct("<d") # CPU time (s) remaining, or 0 for no limit
+# CPU time (s) for the call, for collecting garbage before it (off the
+# clock) and for pondering, current and peak virtual memory and resident set
+# size (MB)
+_USAGE = struct.Struct("<dddddd")
+
+# If a player runs out of time in the middle of some native code, where it
+# can't be interrupted, the operating system will kill its process once it has
+# overrun by this much CPU time (s)
+_KILL_MARGIN = 1.0
+# A pondering player gets this long (wall-clock time, s) to stop when asked
+_PONDER_GRACE = 1.0
+_COLOURS = ["red", "green", "blue"]
+# the referee's ends of the pipes to all of its players' processes still
+# running (each forked process closes its copies of these: see _serve)
+_connections = set()
+
+class RemotePlayer:
+    """
+    Runs a Player class in its own process, and provides methods mirroring
+    the Player's to call it there. Each of these returns the result of the
+    call (if any), how long the call took (CPU time, in seconds) and the
+    space usage of the player's process (current and peak virtual memory and
+    resident set size, in MB, or None if this can't be measured on this
+    platform).
+
+    Each method also takes the player's remaining time budget (in seconds, or
+    0 for no limit). The player is interrupted if it runs out of time during
+    the call, and then the method throws a ResourceLimitException (via
+    `timer`, a _CountdownTimer, which is charged for the time used).
+
+    Between calls, the player may ponder, if `timer.ponder_mode` allows (see
+    referee.player.PlayerWrapper). Its process measures the time that takes,
+    and `timer` accounts for it at the next call.
+    """
+    def __init__(self, colour, Player, timer, space):
+        self.colour = colour
+        self.timer = timer
+        # NOTE: The player's process is forked (rather than spawned), so it
+        # starts with the Player class already imported.
+        context = multiprocessing.get_context('fork')
+        self._conn, child_conn = context.Pipe()
+        _connections.add(self._conn)
+        self._process = context.Process(target=_serve,
+            args=(colour, Player, timer.gc.policy, space.sampler.every,
+                timer.ponder_mode, child_conn), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def init(self, budget):
+        return self._call(_INIT, budget, b"")
+    def action(self, budget):
+        return self._call(_ACTION, budget, b"", returns_action=True)
+    def update(self, budget, colour, action):
+        return self._call(_UPDATE, budget,
+            bytes((_COLOURS.index(colour),)) + pack_action(action))
+
+    def close(self):
+        """Stop the player's process."""
+        if self._process is not None:
+            try:
+                self._conn.send_bytes(bytes((_QUIT,)))
+            except OSError:
+                pass # it has already gone
+            self._process.join()
+            _connections.discard(self._conn)
+            self._conn.close()
+            self._process = None
+
+    def _call(self, code, budget, args, returns_action=False):
+        try:
+            self._conn.send_bytes(bytes((code,)) + _BUDGET.pack(budget) + args)
+            reply = self._conn.recv_bytes()
+        except (EOFError, OSError):
+            self._process.join()
+            if self._process.exitcode == -signal.SIGXCPU:
+                # killed by the operating system for running out of time
+                self.timer.charge(budget)
+                self.timer.timeout()
+            raise RuntimeError(f"{self.colour} player's process exited "
+                f"unexpectedly (exit code {self._process.exitcode})") from None
+        if reply[0] == _ERROR:
+            raise pickle.loads(reply[1:])
+        elapsed, gc_elapsed, ponder_elapsed, *space = _USAGE.unpack_from(
+            reply, 1)
+        self.timer.gc.record(gc_elapsed)
+        self.timer.ponder(ponder_elapsed)
+        if reply[0] == _TIMEOUT:
+            self.timer.charge(elapsed)
+            self.timer.timeout()
+        if space[0] != space[0]: # NaN: space usage not measured
+            space = None
+        result = None
+        if returns_action:
+            result = unpack_action(reply[1+_USAGE.size:])
+        return result, elapsed, space
+
+def _serve(colour, Player, gc_policy, space_sampling, ponder_mode, conn):
+    """
+    Main loop of a player's process: Carry out requests from the referee
+    until asked to quit (or until the referee goes away), pondering in
+    between (under `ponder_mode`) if the player can.
+    """
+    # NOTE: imported here, since referee.player itself imports this module
+    from referee import player as _player
+
+    # close this process's copies of the referee's ends of the pipes (to
+    # this player and any others), so that when the referee goes away (or
+    # closes its end), the pipe reports EOF and this process quits
+    for referee_conn in _connections:
+        referee_conn.close()
+    _connections.clear()
+
+    # (the thread to ponder in is part of the referee's machinery, so it
+    # comes before the baseline for the player's space usage)
+    ponderer = None
+    if ponder_mode != "off":
+        ponderer = _Ponderer()
+    charged = ponder_mode == "charged"
+
+    # measure space usage from here, since everything up to this point was
+    # inherited from the referee's process. For the same reason, leave the
+    # inherited objects out of garbage collection, so that collections only
+    # have to look at the player's own objects.
+    _player.set_space_line()
+    gc.freeze()
+    collector = _player._GarbageCollector(gc_policy)
+    sampler = _player._SpaceSampler(space_sampling)
+    player = None
+    pondering = False
+    while True:
+        try:
+            request = conn.recv_bytes()
+        except (EOFError, OSError):
+            break
+        code = request[0]
+
+        # whatever the request, stop pondering first
+        ponder_elapsed = 0.0
+        if pondering:
+            pondering = False
+            try:
+                ponder_elapsed = ponderer.stop()
+            except Exception as e:
+                if code != _QUIT:
+                    conn.send_bytes(bytes((_ERROR,)) + _pickle_exception(e))
+                break
+        if code == _QUIT:
+            break
+        budget, = _BUDGET.unpack_from(request, 1)
+        if budget and charged:
+            # (the referee doesn't know about this pondering yet)
+            budget = max(budget - ponder_elapsed, 1e-6)
+        args = request[1+_BUDGET.size:]
+
+        # clean up memory off the clock, then time the call
+        gc_elapsed = collector.collect()
+        start = time.process_time()
+        status = _OK
+        if budget:
+            _player._start_alarm(budget)
+            # (and as a last resort, in case the alarm can't interrupt it:)
+            _limit_cpu(start + budget + _KILL_MARGIN)
+        try:
+            action = None
+            if code == _INIT:
+                player = Player(colour)
+            elif code == _ACTION:
+                action = player.action()
+            else: # code == _UPDATE:
+                player.update(_COLOURS[args[0]], unpack_action(args[1:]))
+        except _player._OutOfTime:
+            status = _TIMEOUT
+        except Exception as e:
+            conn.send_bytes(bytes((_ERROR,)) + _pickle_exception(e))
+            continue
+        finally:
+            if budget:
+                _player._stop_alarm()
+        elapsed = time.process_time() - start
+
+        space = sampler.sample() or (float('nan'),) * 3
+        reply = bytes((status,)) + _USAGE.pack(elapsed, gc_elapsed,
+            ponder_elapsed, *space)
+        if code == _ACTION:
+            reply += pack_action(action)
+        conn.send_bytes(reply)
+
+        # ponder until the next request (except after an action, since the
+        # update for it comes straight away)
+        if ponderer is not None and status == _OK and code != _ACTION \
+                and hasattr(player, "ponder"):
+            if budget and charged:
+                _limit_cpu(time.process_time() + budget - elapsed
+                    + _KILL_MARGIN)
+            else:
+                _limit_cpu(None)
+            ponderer.start(player, charged)
+            pondering = True
+
+def _limit_cpu(seconds):
+    """
+    Have the operating system kill this process (with SIGXCPU) once it has
+    used `seconds` of CPU time in total (or None to lift the limit, as far
+    as the hard limit allows).
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        soft = hard
+    else:
+        soft = math.ceil(seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+class _Ponderer:
+    """
+    A thread for a player to ponder in (see _serve), between calls, which
+    measures the CPU time the player spends pondering.
+
+    There is just the one thread, for the life of the process, started like
+    the referee's other threads (see referee.player.start_referee_thread),
+    so that pondering adds nothing to the process's virtual memory usage
+    beyond what the player itself allocates.
+    """
+    def __init__(self):
+        # NOTE: imported here, since referee.player itself imports this module
+        from referee.player import start_referee_thread
+        self._go = threading.Event()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._player = None
+        self._charged = False
+        self._elapsed = 0.0
+        self._error = None
+        # (but with a full-size stack, since the player's code runs in it)
+        start_referee_thread(self._run, stack_size=0)
+
+    def start(self, player, charged):
+        """Have a player start pondering."""
+        self._player, self._charged = player, charged
+        self._stop.clear()
+        self._done.clear()
+        self._go.set()
+
+    def stop(self):
+        """
+        Ask the player to stop pondering, and wait for it. Return the CPU
+        time (s) it spent pondering, or raise the exception it raised (or
+        RuntimeError, if it doesn't stop in time).
+        """
+        self._stop.set()
+        if not self._done.wait(_PONDER_GRACE):
+            raise RuntimeError("player didn't stop pondering when asked to")
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        return self._elapsed
+
+    def _run(self):
+        while True:
+            self._go.wait()
+            self._go.clear()
+            start = time.thread_time()
+            try:
+                self._player.ponder(self._stop, self._charged)
+            except Exception as e:
+                self._error = e
+            self._elapsed = time.thread_time() - start
+            self._done.set()
+
+def _pickle_exception(e):
+    """Pickle an exception raised by a player, or a description of it."""
+    try:
+        data = pickle.dumps(e)
+        pickle.loads(data) # (some exceptions can be pickled but not unpickled)
+        return data
+    except Exception:
+        return pickle.dumps(RuntimeError("".join(
+            traceback.format_exception(type(e), e, e.__traceback__))))
@@ -0,0 +1,150 @@
+"""
+Colour-rotation symmetry of Chexers positions.
+
+Rotating the board by 120 degrees, (q, r) -> (-q-r, q), maps red's starting
+and finishing hexes onto green's, green's onto blue's, and blue's onto red's.
+So rotating a position and relabelling its colours (red to green, green to
+blue, blue to red) gives a position that is strategically the same, for the
+colour whose turn it is. Since the turn order (red, green, blue) is cyclic,
+the relabelling also preserves it.
+
+Each position therefore has a canonical representative: the rotation of it
+in which it's red's turn. Caches, books and datasets keyed by canonical
+positions can share one entry between all three rotations.
+"""
+
+from referee.board import CELLS, CELL_INDEX, N_CELLS, ZOBRIST, ZOBRIST_TURN
+from referee.board import JUMPED, cells_of
+
+_COLOURS = "rgb"
+
+def _rotate_qr(qr):
+    q, r = qr
+    return (-q-r, q)
+
+# ROTATE_CELL[k][n] is the cell that cell n goes to when rotated k times (and
+# ROTATE_CELL[k][-1] is -1, for the unused cells of moves)
+ROTATE_CELL = [list(range(N_CELLS)) + [-1]]
+for _ in range(2):
+    ROTATE_CELL.append([CELL_INDEX[_rotate_qr(CELLS[n])] if n >= 0 else -1
+        for n in ROTATE_CELL[-1]])
+# ROTATE_COLOUR[k][colour] is the colour that colour becomes, similarly
+ROTATE_COLOUR = [{c: _COLOURS[(i + k) % 3] for i, c in enumerate(_COLOURS)}
+    for k in range(3)]
+
+def rotations_to_red(turn):
+    """How many rotations make it red's turn, if it's colour `turn`'s turn."""
+    return -_COLOURS.index(turn) % 3
+
+
+# Rotating cell masks: a table for each byte of a mask (the rotation of each
+# possible byte value at that position), for each number of rotations
+
+_NBYTES = (N_CELLS + 7) // 8
+def _byte_tables(k):
+    tables = []
+    for i in range(_NBYTES):
+        table = []
+        for byte in range(256):
+            mask = 0
+            for bit in cells_of(byte << 8*i):
+                if bit < N_CELLS:
+                    mask |= 1 << ROTATE_CELL[k][bit]
+            table.append(mask)
+        tables.append(table)
+    return tables
+_BYTE_TABLES = [_byte_tables(k) for k in range(3)]
+
+def rotate_mask(mask, k):
+    """Rotate a cell mask k times."""
+    rotated = 0
+    for table in _BYTE_TABLES[k]:
+        rotated |= table[mask & 0xFF]
+        mask >>= 8
+    return rotated
+
+def rotate_move(move, k):
+    """Rotate a move (see referee.game.Chexers.moves) k times."""
+    atype, a, b = move
+    table = ROTATE_CELL[k]
+    return (atype, table[a], table[b])
+
+def rotate_action(action, k):
+    """Rotate an action (in the referee's format) k times."""
+    atype, aargs = action
+    for _ in range(k % 3):
+        if atype == "MOVE" or atype == "JUMP":
+            aargs = (_rotate_qr(aargs[0]), _rotate_qr(aargs[1]))
+        elif atype == "EXIT":
+            aargs = _rotate_qr(aargs)
+    return (atype, aargs)
+
+def rotate(pieces, score, k):
+    """
+    Rotate a position (a dict of cell masks by colour, and one of scores by
+    colour) k times, returning the rotated (pieces, score).
+    """
+    colours = ROTATE_COLOUR[k]
+    return ({colours[c]: rotate_mask(mask, k) for c, mask in pieces.items()},
+        {colours[c]: s for c, s in score.items()})
+
+def canonical(pieces, score, turn):
+    """
+    The canonical representative of a position with colour `turn` to move:
+    return its (pieces, score), rotated so that it's red's turn, and the
+    number of rotations that took (rotate actions by the same number to
+    carry them over, and back by minus that number).
+    """
+    k = rotations_to_red(turn)
+    return rotate(pieces, score, k) + (k,)
+
+
+class SymmetricHash:
+    """
+    Keep the Zobrist hashes (see referee.board) of all three rotations of a
+    (referee Chexers) game's position up to date as moves are made and
+    unmade on it (see make and unmake), so that the hash of the canonical
+    position is always at hand.
+
+    (Like the game's own hash, the canonical position's hash covers the
+    pieces and whose turn it is, but not the scores: see rotate for those.)
+    """
+    def __init__(self, game):
+        self.game = game
+        self.hashes = [0, 0, 0]
+        for k in range(3):
+            keys = _ROTATED_ZOBRIST[k]
+            for colour, mask in game.board.pieces.items():
+                for n in cells_of(mask):
+                    self.hashes[k] ^= keys[colour][n]
+
+    def make(self, token):
+        """Update the hashes for a move just made (given its undo token)."""
+        (atype, a, b), col, over, _, _ = token
+        if atype == "PASS":
+            return
+        hashes = self.hashes
+        for k in range(3):
+            keys = _ROTATED_ZOBRIST[k][col]
+            if atype == "EXIT":
+                hashes[k] ^= keys[a]
+                continue
+            hashes[k] ^= keys[a] ^ keys[b]
+            if atype == "JUMP" and over != col:
+                c = JUMPED[a][b]
+                hashes[k] ^= _ROTATED_ZOBRIST[k][over][c] ^ keys[c]
+    # (each change is an XOR, so undoing a move is the same as making it)
+    unmake = make
+
+    def canonical(self):
+        """
+        The hash of the canonical position (with red to move) and the number
+        of rotations from the game's position to it.
+        """
+        k = rotations_to_red(self.game.turn())
+        return self.hashes[k] ^ ZOBRIST_TURN[0], k
+
+# _ROTATED_ZOBRIST[k][colour][n] is the Zobrist key that a piece of a colour
+# on cell n has once the position is rotated k times
+_ROTATED_ZOBRIST = [{c: [ZOBRIST[ROTATE_COLOUR[k][c]][ROTATE_CELL[k][n]]
+    for n in range(N_CELLS)] for c in _COLOURS} for k in range(3)]
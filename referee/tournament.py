@@ -0,0 +1,422 @@
+"""
+Driver program to conduct a tournament of many games of Chexers between a
+set of Player classes, playing several games at once in separate processes.
+
+Run with `python -m referee.tournament player1 player2 ...` (see `--help`).
+"""
+
+import os
+import sys
+import argparse
+import itertools
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import Counter
+
+from referee.__main__ import play
+from referee.game import IllegalActionException
+from referee.player import PlayerWrapper, ResourceLimitException, set_space_line
+from referee.player import _load_player_class
+from referee.options import get_tournament_options
+from referee.metrics import MetricsWriter
+from referee.record import GameRecorder
+
+_COLOURS = ('red', 'green', 'blue')
+
+def main():
+    options = get_tournament_options()
+    specs = options.player_locs
+    names = [_spec_name(spec) for spec in specs]
+
+    seatings = _seatings(len(specs))
+    ngames = options.games if options.games is not None else len(seatings)
+    games = [(i, seatings[i % len(seatings)]) for i in range(ngames)]
+
+    # start these files afresh: each game appends its records to them
+    if options.metrics is not None:
+        MetricsWriter(options.metrics).close()
+    if options.record is not None:
+        open(options.record, 'wb').close()
+
+    stats = _TournamentStats(names)
+    for record in run_tournament(specs, games, options, jobs=options.jobs,
+            fork_server=options.fork_server):
+        stats.add(record)
+        if options.verbosity > 0:
+            say(_describe(record, names, ngames))
+    for line in stats.summary():
+        say(line)
+
+def run_tournament(specs, games, options, jobs=None, fork_server=False):
+    """
+    Play a list of games (each a pair of a game number and a seating, that is,
+    a tuple of indices into `specs` for red, green and blue), with up to
+    `jobs` games (default: one per CPU core) running at once. Each game runs
+    in its own process, so that games can't affect each other.
+
+    If `fork_server`, the players' packages are imported just once, into a
+    'zygote' process, which then forks a fresh child process for each game
+    (instead of each game importing them again).
+
+    Generate a result record (a dict) for each game, as each game finishes.
+    A game stopped by an illegal action, a resource limit, or a player
+    crashing (even crashing its whole process) still produces a record,
+    with a description of the problem under 'error'.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    context = multiprocessing.get_context('fork')
+    results, channel = _ResultChannel.open(context)
+    if fork_server:
+        launcher = _ForkServer(context, specs, options, channel)
+    else:
+        launcher = _ProcessLauncher(context, specs, options, channel)
+
+    pending = list(reversed(games))
+    running = {} # game number -> result record (None until it arrives)
+    seatings = dict(games)
+    try:
+        while pending or running:
+            # keep all of the job slots busy
+            while pending and len(running) < jobs:
+                number, seating = pending.pop()
+                launcher.start(number, seating)
+                running[number] = None
+
+            # then report on any games that have finished
+            ready = wait([results] + launcher.waitables())
+            exits = list(launcher.exited(ready))
+            # (results are sent before exiting, so collect them first)
+            while results.poll():
+                message, number, content = results.recv()
+                if message == "result":
+                    if number in running:
+                        running[number] = content
+                else: # message == "exit"
+                    exits.append((number, _crash_message(content)))
+            for number, crash in exits:
+                if number not in running:
+                    continue # (already reported)
+                record = running.pop(number)
+                launcher.finished(number)
+                if record is None:
+                    # the game's process died before it could send a result
+                    record = _game_record(number, seatings[number])
+                    record['error'] = crash
+                yield record
+    finally:
+        launcher.close()
+        results.close()
+
+class _ResultChannel:
+    """
+    The sending end of a pipe shared by all of the game processes, which use
+    it to send their results (and, for a fork server, exit codes) back to the
+    tournament. A lock (also shared) keeps their messages from interleaving.
+    """
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+    @classmethod
+    def open(cls, context):
+        """Create a channel, returning a (receiving connection, channel)."""
+        recv_conn, send_conn = context.Pipe(duplex=False)
+        return recv_conn, cls(send_conn, context.Lock())
+    def send(self, message, number, content):
+        with self.lock:
+            self.conn.send((message, number, content))
+
+class _ProcessLauncher:
+    """Start each game in a new process, forked from this one."""
+    def __init__(self, context, specs, options, channel):
+        self.context = context
+        self.specs = specs
+        self.options = options
+        self.channel = channel
+        self.processes = {} # process sentinel -> (game number, process)
+    def start(self, number, seating):
+        process = self.context.Process(target=_play_game,
+            args=(number, seating, self.specs, self.options, self.channel))
+        process.start()
+        self.processes[process.sentinel] = (number, process)
+    def waitables(self):
+        return list(self.processes)
+    def exited(self, ready):
+        """
+        Generate (game number, crash message) for the processes now done
+        (the message is only used if the game sent no result).
+        """
+        for sentinel in ready:
+            if sentinel in self.processes:
+                number, process = self.processes.pop(sentinel)
+                process.join()
+                yield number, _crash_message(process.exitcode)
+    def finished(self, number):
+        pass # (the game's process was forgotten when it exited)
+    def close(self):
+        for number, process in self.processes.values():
+            process.terminate()
+            process.join()
+
+class _ForkServer:
+    """
+    Start each game in a fresh process forked from a 'zygote' process, which
+    has already imported all of the players' packages. Each game then starts
+    in the time it takes to fork, rather than to import the packages again.
+    The zygote reports the exit codes of the games' processes through the
+    result channel.
+
+    If the zygote itself dies (taking any games still running with it), every
+    game still running, or still to start, is reported as crashed.
+    """
+    def __init__(self, context, specs, options, channel):
+        self.control, zygote_control = context.Pipe()
+        self.zygote = context.Process(target=_zygote,
+            args=(specs, options, zygote_control, channel))
+        self.zygote.start()
+        zygote_control.close()
+        # (the numbers of the games still running, in case the zygote dies)
+        self.started = set()
+    def start(self, number, seating):
+        self.started.add(number)
+        if self.zygote.exitcode is None:
+            try:
+                self.control.send((number, seating))
+            except OSError:
+                pass # (the zygote has died: see exited)
+    def waitables(self):
+        return [self.zygote.sentinel]
+    def exited(self, ready):
+        """
+        Generate (game number, crash message) for each game still running,
+        if the zygote has died (games that finish are reported through the
+        result channel instead).
+        """
+        if self.zygote.sentinel in ready:
+            self.zygote.join()
+            crash = ("fork server crashed (exit code "
+                f"{self.zygote.exitcode})")
+            for number in self.started:
+                yield number, crash
+            self.started.clear()
+    def finished(self, number):
+        """Forget a game once it has been reported."""
+        self.started.discard(number)
+    def close(self):
+        try:
+            self.control.send(None)
+        except OSError:
+            pass # (the zygote has died already)
+        self.zygote.join()
+        self.control.close()
+
+def _zygote(specs, options, control, channel):
+    """
+    Main loop of the fork server's zygote process: Import the players'
+    packages, then fork a child process to play each game requested through
+    `control` (until sent None), and report each child's exit code.
+    """
+    for player_pkg, player_cls in specs:
+        try:
+            _load_player_class(player_pkg, player_cls)
+        except Exception:
+            pass # never mind, each game will report this for itself
+
+    children = {} # pid -> (game number, pidfd or None)
+    running = True
+    while running or children:
+        # wait for a request or for a child to exit (if we can get a file
+        # descriptor for each child to wait on, otherwise poll for exits)
+        pidfds = [pidfd for _, pidfd in children.values() if pidfd is not None]
+        timeout = None if len(pidfds) == len(children) else 0.05
+        ready = wait(([control] if running else []) + pidfds, timeout)
+        if control in ready:
+            request = control.recv()
+            if request is None:
+                running = False
+            else:
+                number, seating = request
+                pid = os.fork()
+                if pid == 0:
+                    # in the child process: play the game, and that's all
+                    control.close()
+                    exitcode = 1
+                    try:
+                        # (space usage is measured against a baseline taken
+                        # within the child, by `_play_game`)
+                        _play_game(number, seating, specs, options, channel)
+                        exitcode = 0
+                    finally:
+                        os._exit(exitcode)
+                pidfd = None
+                if hasattr(os, 'pidfd_open'):
+                    pidfd = os.pidfd_open(pid)
+                children[pid] = (number, pidfd)
+
+        for pid in list(children):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                number, pidfd = children.pop(pid)
+                if pidfd is not None:
+                    os.close(pidfd)
+                channel.send("exit", number, os.waitstatus_to_exitcode(status))
+
+def _play_game(number, seating, specs, options, channel):
+    """Play one game and send its result record back through `channel`."""
+    # the game's output (and its players') would only get in the way:
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    options = argparse.Namespace(**vars(options))
+    options.verbosity = 0
+
+    record = _game_record(number, seating)
+    players = []
+    metrics = recorder = None
+    if options.metrics is not None:
+        metrics = MetricsWriter(options.metrics, game=number, append=True)
+    if options.record is not None:
+        recorder = GameRecorder(options.record, number, append=True)
+    try:
+        for colour, i in zip(_COLOURS, seating):
+            players.append(_TrackedPlayerWrapper(colour, specs[i], options))
+        set_space_line()
+        game = play(*players, options, metrics, recorder)
+        record['turns'] = game.nturns
+        if game.drawmsg:
+            record['draw'] = game.drawmsg
+        else:
+            record['winner'] = max(game.score, key=game.score.get)
+    except IllegalActionException:
+        record['error'] = "illegal action"
+    except ResourceLimitException as e:
+        record['error'] = f"resource limit exceeded ({e})"
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if metrics is not None:
+            metrics.close()
+        # (this process may leave by os._exit, so stop the players' processes
+        # now, rather than relying on them noticing it's gone)
+        for player in players:
+            player.close()
+    if record['error'] is not None:
+        record['culprit'] = _TrackedPlayerWrapper.last_called
+    record['cpu'] = [player.timer.clock for player in players]
+    channel.send("result", number, record)
+
+def _crash_message(exitcode):
+    return f"game process crashed (exit code {exitcode})"
+
+def _game_record(number, seating):
+    return {
+        'game': number, 'seating': seating,
+        'winner': None, 'draw': None, 'error': None, 'culprit': None,
+        'turns': None, 'cpu': [],
+    }
+
+class _TrackedPlayerWrapper(PlayerWrapper):
+    """
+    A PlayerWrapper which remembers which player was called most recently,
+    so that when a game is stopped by an exception we know whose fault it
+    was (illegal actions come straight after the culprit's `action()`).
+    """
+    last_called = None
+    def __init__(self, colour, player_loc, options):
+        _TrackedPlayerWrapper.last_called = colour
+        super().__init__(colour, player_loc, options)
+    def init(self):
+        _TrackedPlayerWrapper.last_called = self.colour
+        super().init()
+    def action(self):
+        _TrackedPlayerWrapper.last_called = self.colour
+        return super().action()
+    def update(self, colour, action):
+        _TrackedPlayerWrapper.last_called = self.colour
+        super().update(colour, action)
+
+
+def _seatings(nplayers):
+    """
+    All of the ways to seat the players (by index) as red, green and blue:
+    every ordering of every three distinct players, or with fewer than three
+    players, every seating using more than one of them.
+    """
+    if nplayers >= 3:
+        return list(itertools.permutations(range(nplayers), 3))
+    seatings = itertools.product(range(nplayers), repeat=3)
+    return [s for s in seatings if nplayers == 1 or len(set(s)) > 1]
+
+def _spec_name(spec):
+    mod, cls = spec
+    return mod if cls == "Player" else f"{mod}:{cls}"
+
+
+class _TournamentStats:
+    """Accumulate per-player and overall statistics from game records."""
+    def __init__(self, names):
+        self.names = names
+        self.games = 0
+        self.draws = Counter()
+        self.errors = Counter()
+        self.player = [Counter() for _ in names]
+        self.cpu = [0.0 for _ in names]
+
+    def add(self, record):
+        self.games += 1
+        # (a game stopped while loading players has no cpu times for some)
+        cpus = record['cpu'] + [0.0] * (len(_COLOURS) - len(record['cpu']))
+        for colour, i, cpu in zip(_COLOURS, record['seating'], cpus):
+            stats = self.player[i]
+            stats['seats'] += 1
+            self.cpu[i] += cpu
+            if record['error'] is not None:
+                if record['culprit'] == colour:
+                    stats['errors'] += 1
+            elif record['draw'] is not None:
+                stats['draws'] += 1
+            elif record['winner'] == colour[0]:
+                stats['wins'] += 1
+            else:
+                stats['losses'] += 1
+        if record['draw'] is not None:
+            self.draws[record['draw']] += 1
+        if record['error'] is not None:
+            self.errors[record['error']] += 1
+
+    def summary(self):
+        """Generate lines of text summarising the tournament."""
+        yield f"== tournament over: {self.games} games played =="
+        width = max(len(name) for name in self.names)
+        yield (f"{'player':{width}s}  seats   wins  draws losses errors  "
+            "cpu time (total, per seat)")
+        for name, stats, cpu in zip(self.names, self.player, self.cpu):
+            per_seat = cpu / stats['seats'] if stats['seats'] else 0.0
+            yield (f"{name:{width}s}  {stats['seats']:5d}  {stats['wins']:5d}"
+                f"  {stats['draws']:5d}  {stats['losses']:5d}  "
+                f"{stats['errors']:5d}  {cpu:9.3f}s {per_seat:8.3f}s")
+        for reason, count in self.draws.most_common():
+            yield f"draws: {count:5d} x {reason}"
+        for reason, count in self.errors.most_common():
+            yield f"errors: {count:4d} x {reason}"
+
+def _describe(record, names, ngames):
+    """A one-line description of the result of a game."""
+    seats = ", ".join(f"{colour}: {names[i]}"
+        for colour, i in zip(_COLOURS, record['seating']))
+    if record['error'] is not None:
+        culprit = record['culprit'] or "unknown"
+        result = f"error ({culprit} player): {record['error']}"
+    elif record['draw'] is not None:
+        result = f"draw detected: {record['draw']}"
+    else:
+        winner, = [c for c in _COLOURS if c[0] == record['winner']]
+        result = f"winner: {winner}"
+    turns = f" after {record['turns']} turns" if record['turns'] else ""
+    return f"game {record['game']+1}/{ngames} ({seats}) {result}{turns}"
+
+def say(message):
+    """Helper function to display a message from the tournament"""
+    print("*", message, flush=True)
+
+
+if __name__ == '__main__':
+    main()
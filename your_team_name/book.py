@@ -0,0 +1,114 @@
+"""
+An opening book for the player: the best move (and its value) for positions
+in the opening, found offline by deep searches, so that the player needn't
+spend its time budget working them out again in every game.
+
+The book is a binary file of fixed-size records sorted by position key (see
+ttable.position_key), which the player memory-maps and binary-searches: so
+opening it costs almost nothing, and only the pages it touches are read in.
+Positions are canonical (see referee.symmetry), so one record covers all
+three rotations of a position.
+
+Build a book with `python -m your_team_name.build_book` (see `--help`).
+"""
+
+import os
+import mmap
+import struct
+
+from referee.game import Chexers, pack_move, unpack_move
+from referee.symmetry import SymmetricHash, rotate_move
+from your_team_name.evaluate import Evaluator
+from your_team_name.search import Search
+from your_team_name.ttable import TranspositionTable, position_key
+
+# the default book file, alongside the player (it isn't checked in: build it)
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "book.bin")
+
+# File format: a header (magic bytes and the number of records), then the
+# records, each a position key (for the colour to move), the value of the
+# position for that colour (see evaluate), and the (packed) best move in the
+# canonical position, in order of key
+_MAGIC = b"CHXBOOK1"
+_HEADER = struct.Struct("<8sI4x")
+_RECORD = struct.Struct("<QiH2x")
+
+class OpeningBook:
+    """A book file, memory-mapped for lookups."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC or len(self.map) != _HEADER.size \
+                + self.size * _RECORD.size:
+            self.map.close()
+            raise ValueError(f"{path} is not a valid opening book")
+
+    def lookup(self, key):
+        """
+        Find a position (by key) in the book, returning its best move (in the
+        canonical position) and value, or None if it's not in the book.
+        """
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, value, code = _RECORD.unpack_from(self.map,
+                _HEADER.size + mid * _RECORD.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return unpack_move(code), value
+        return None
+
+    def close(self):
+        self.map.close()
+
+def open_book(path=BOOK_FILE):
+    """
+    Open a book file, or return None if there isn't one (or it's not a book):
+    the player just searches every position for itself.
+    """
+    try:
+        return OpeningBook(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def build(path, plies, width, depth, megabytes=64, progress=None):
+    """
+    Build a book of the positions within `plies` plies of the start of the
+    game, reached by each colour playing one of its `width` best moves (by a
+    search `depth` plies deep), and write it to `path`. Return the number of
+    positions in the book.
+    """
+    game = Chexers(None)
+    # (the searches for each colour can share everything but their colour)
+    table = TranspositionTable(megabytes)
+    evaluator, symmetric = Evaluator(game), SymmetricHash(game)
+    searches = {colour: Search(game, colour, table, evaluator, symmetric)
+        for colour in "rgb"}
+    records = {}
+    def visit(ply):
+        key, k = position_key(game, symmetric, game.turn())
+        if game.over() or key in records:
+            return
+        moves, value = searches[game.turn()].analyse(depth)
+        records[key] = (value, pack_move(rotate_move(moves[0], k)))
+        if progress is not None:
+            progress(len(records))
+        if ply < plies:
+            for move in moves[:width]:
+                # (any of the searches keeps the shared state up to date)
+                token = searches['r'].make_move(move)
+                visit(ply + 1)
+                searches['r'].unmake_move(token)
+    visit(0)
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(records)))
+        for key in sorted(records):
+            f.write(_RECORD.pack(key, *records[key]))
+    return len(records)
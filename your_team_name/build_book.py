@@ -0,0 +1,34 @@
+"""
+Build an opening book for the player (see your_team_name.book), e.g.:
+
+    python -m your_team_name.build_book --plies 6 --width 3 --depth 6
+"""
+
+import argparse
+
+from your_team_name import book
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m your_team_name.build_book",
+        description="Build an opening book for the player.")
+    parser.add_argument("-o", "--output", default=book.BOOK_FILE,
+        help="where to write the book (default: %(default)s)")
+    parser.add_argument("-p", "--plies", type=int, default=6,
+        help="how many plies from the start of the game to cover "
+        "(default: %(default)s)")
+    parser.add_argument("-w", "--width", type=int, default=3,
+        help="how many of its best moves each colour may play in the book "
+        "(default: %(default)s)")
+    parser.add_argument("-d", "--depth", type=int, default=6,
+        help="how deep to search each position, in plies (default: "
+        "%(default)s)")
+    args = parser.parse_args()
+    def progress(n):
+        print(f"\r{n} positions searched", end="", flush=True)
+    n = book.build(args.output, args.plies, args.width, args.depth,
+        progress=progress)
+    print(f"\nwrote {n} positions to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Static evaluation of Chexers positions, for the player's search.
+
+Each colour's position is summarised as a utility (higher is better for that
+colour), from a few features: how many pieces it holds, how far they are
+from its finishing hexes (so how many actions it still needs to win), and
+how many jumps it threatens or is exposed to. The features are kept up to
+date incrementally (see Evaluator), so evaluating a position costs the same
+however many pieces there are.
+"""
+
+from referee.board import N_CELLS, NEIGHBOURS, JUMPS, JUMPED
+from referee.board import FINISH_MASKS, cells_of
+
+# a colour wins once this many of its pieces have exited
+EXITS_TO_WIN = 4
+# (a utility beyond any static evaluation, for a won game)
+WIN = 1000000
+
+# utility per action a colour still needs, and per piece it holds
+_ACTION_VALUE = 10
+_PIECE_VALUE = 3
+# utility per jump a colour threatens (that would capture a piece), and per
+# piece it has exposed to capture
+_THREAT_VALUE = 2
+_EXPOSED_VALUE = 4
+# the actions a colour is taken to need for each piece it is short of
+# winning (until it captures one, it can't win at all)
+_MISSING_PIECE_ACTIONS = 12
+
+_COLOURS = "rgb"
+_INDEX = {colour: i for i, colour in enumerate(_COLOURS)}
+
+
+# Distance tables: the number of actions from each cell to each colour's
+# finishing hexes (not counting the exit itself), by moves alone and by
+# moves or jumps (as if there were always a piece to jump over), indexed by
+# colour then cell number.
+
+def _distances(colour, jumps):
+    """Breadth-first search (backwards) from colour's finishing hexes."""
+    distance = [None] * N_CELLS
+    frontier = list(cells_of(FINISH_MASKS[colour]))
+    for n in frontier:
+        distance[n] = 0
+    for n in frontier: # (the frontier grows as we go)
+        targets = NEIGHBOURS[n] + (JUMPS[n] if jumps else ())
+        for m in targets:
+            if m >= 0 and distance[m] is None:
+                distance[m] = distance[n] + 1
+                frontier.append(m)
+    return distance
+
+DISTANCE = {colour: _distances(colour, False) for colour in _COLOURS}
+HOPS = {colour: _distances(colour, True) for colour in _COLOURS}
+
+
+# Jump threats: every (source, over, landing) triple of cells for a jump,
+# and for each action, the triples involving any cell the action changes
+# (those are the only triples whose threats the action can change)
+
+_TRIPLES = [(s, NEIGHBOURS[s][d], JUMPS[s][d])
+    for s in range(N_CELLS) for d in range(6) if JUMPS[s][d] >= 0]
+_TRIPLES_AT = [[t for t in _TRIPLES if n in t] for n in range(N_CELLS)]
+_triples_near = {}
+
+def _near(a, b, c):
+    """The triples involving any of cells a, b or c (-1 for none)."""
+    key = (a, b, c)
+    triples = _triples_near.get(key)
+    if triples is None:
+        triples = set()
+        for n in key:
+            if n >= 0:
+                triples.update(_TRIPLES_AT[n])
+        triples = _triples_near[key] = tuple(triples)
+    return triples
+
+
+class Evaluator:
+    """
+    Keep the features of a (referee Chexers) game's position, for each
+    colour, up to date as moves are made and unmade on it (see make and
+    unmake), each at a small, constant cost.
+    """
+    def __init__(self, game):
+        self.game = game
+        board = game.board
+        # each cell's colour index plus 1, or 0 if it's empty
+        self.cells = [" rgb".index(board.colour_at(n)) for n in range(N_CELLS)]
+        # per colour index: pieces held, summed distances (see DISTANCE and
+        # HOPS), capturing jumps threatened, and pieces exposed to capture
+        self.count = [0, 0, 0]
+        self.steps = [0, 0, 0]
+        self.hops = [0, 0, 0]
+        for i, colour in enumerate(_COLOURS):
+            for n in cells_of(board.pieces[colour]):
+                self.count[i] += 1
+                self.steps[i] += DISTANCE[colour][n]
+                self.hops[i] += HOPS[colour][n]
+        # (indexed by colour index plus 1, like cells)
+        self.threats = [0, 0, 0, 0]
+        self.exposed = [0, 0, 0, 0]
+        self._count_threats(_TRIPLES, 1)
+
+    def make(self, token):
+        """Update the features for a move just made (given its undo token)."""
+        self._update(token, 1)
+    def unmake(self, token):
+        """Update the features for a move just unmade (given its token)."""
+        self._update(token, -1)
+
+    def _update(self, token, sign):
+        (atype, a, b), col, over, _, _ = token
+        if atype == "PASS":
+            return
+        c = JUMPED[a][b] if atype == "JUMP" and over != col else -1
+        triples = _near(a, b, c)
+        self._count_threats(triples, -1)
+
+        cells = self.cells
+        i = _INDEX[col]
+        value = i + 1
+        steps, hops = DISTANCE[col], HOPS[col]
+        if atype == "EXIT":
+            # (a piece leaves cell a, or comes back to it)
+            cells[a] = 0 if sign > 0 else value
+            self.count[i] -= sign
+            self.steps[i] -= sign * steps[a]
+            self.hops[i] -= sign * hops[a]
+        else:
+            # (a piece moves from cell a to b, or back)
+            cells[a], cells[b] = (0, value) if sign > 0 else (value, 0)
+            self.steps[i] += sign * (steps[b] - steps[a])
+            self.hops[i] += sign * (hops[b] - hops[a])
+            if c >= 0:
+                # (the piece on c converts from over to col, or back)
+                j = _INDEX[over]
+                cells[c] = value if sign > 0 else j + 1
+                self.count[i] += sign
+                self.count[j] -= sign
+                self.steps[i] += sign * steps[c]
+                self.hops[i] += sign * hops[c]
+                self.steps[j] -= sign * DISTANCE[over][c]
+                self.hops[j] -= sign * HOPS[over][c]
+
+        self._count_threats(triples, 1)
+
+    def _count_threats(self, triples, sign):
+        cells, threats, exposed = self.cells, self.threats, self.exposed
+        for s, o, l in triples:
+            x = cells[s]
+            if x and not cells[l]:
+                y = cells[o]
+                if y and y != x:
+                    threats[x] += sign
+                    exposed[y] += sign
+
+    def utility(self, colour):
+        """The utility of the game's position for a colour."""
+        score = self.game.score[colour]
+        if score >= EXITS_TO_WIN:
+            return WIN
+        i = _INDEX[colour]
+        held, needed = self.count[i], EXITS_TO_WIN - score
+        # (the average distance of a piece, between the distance by moves
+        # alone and that with every jump possible)
+        average = (self.steps[i] + self.hops[i]) / (2 * held) if held else 0
+        actions = min(held, needed) * (average + 1)
+        if held < needed:
+            actions += (needed - held) * _MISSING_PIECE_ACTIONS
+        return int(_PIECE_VALUE * held - _ACTION_VALUE * actions
+            + _THREAT_VALUE * self.threats[i+1]
+            - _EXPOSED_VALUE * self.exposed[i+1])
+
+    def evaluate(self, colour):
+        """
+        The value of the game's position for a colour, assuming (paranoid)
+        that both other colours are against it: its own utility less the
+        average of theirs.
+        """
+        others = [self.utility(c) for c in _COLOURS if c != colour]
+        return self.utility(colour) - sum(others) // len(others)
+
@@ -0,0 +1,440 @@
+"""
+An alternative player using Monte Carlo Tree Search (UCT) instead of
+alpha-beta, which suits a three-player game better: each node's statistics
+are kept from the point of view of the colour that moved into it, so every
+colour simply plays to maximise its own chance of winning.
+
+Playouts run in batches in a pool of worker processes (leaf parallelisation):
+the player selects a batch of leaves, with 'virtual loss' spreading the
+selections over the tree, and hands them out to the workers while it selects
+the next batch. Tree statistics are kept in compact arrays, and the tree is
+reused from turn to turn by following the actions given to `update`.
+
+Play with it as `your_team_name.mcts:MCTSPlayer`.
+"""
+
+import gc
+import os
+import math
+import time
+import random
+import multiprocessing
+from multiprocessing.connection import wait
+from array import array
+
+from referee.board import Bitboard, JUMPED
+from referee.game import Chexers, action_to_move, move_to_action
+from referee.game import pack_move, unpack_move
+from your_team_name.evaluate import DISTANCE, EXITS_TO_WIN, Evaluator
+from your_team_name.search import MAX_TURNS, TimeManager
+
+# the CPU time (s) this player allows itself for a whole game (see below):
+# well within the referee's limit (-t, 60s by default), as for
+# your_team_name.player.ExamplePlayer
+TIME_BUDGET = 45.0
+# the number of playout worker processes (with only one, playouts run in
+# the player's own process instead)
+WORKERS = os.cpu_count() or 1
+# the most nodes the tree can hold (about 20 bytes each)
+MAX_NODES = 1000000
+
+# UCT exploration constant
+_EXPLORATION = 1.0
+# a leaf is expanded once it has been visited this many times
+_EXPAND_VISITS = 2
+# playouts per task for a worker, and tasks per worker in each batch
+_PLAYOUTS_PER_TASK = 4
+_TASKS_PER_WORKER = 4
+# playouts stop after this many turns, and score the position instead
+_PLAYOUT_TURNS = 120
+
+_COLOURS = "rgb"
+
+class MCTSPlayer:
+    """
+    A player choosing actions by Monte Carlo Tree Search.
+
+    NOTE: The referee measures the CPU time of the player's own process,
+    which does little more than select leaves and wait for the workers.
+    So that the player still uses no more than its fair share of time, the
+    workers report the CPU time their playouts take, and the player charges
+    that to its budget along with its own: each turn's thinking stops once
+    the two together reach the turn's allocation.
+    """
+    def __init__(self, colour):
+        start = time.process_time()
+        self.colour = colour[0]
+        self.game = Chexers(None)
+        self.tree = _Tree()
+        self.clock = TimeManager(TIME_BUDGET)
+        self.turns = 0
+        self.pool = _WorkerPool(WORKERS) if WORKERS > 1 else None
+        self.rng = random.Random()
+        self.playouts = 0
+        self.clock.charge(time.process_time() - start)
+
+    def action(self):
+        start, worker_start = time.process_time(), self._worker_time()
+        soft, _ = self.clock.allocate(self.turns)
+        moves = self.game.moves()
+        if len(moves) == 1:
+            move = moves[0]
+        else:
+            self._think(lambda: time.process_time() - start
+                + self._worker_time() - worker_start, soft)
+            move = self.tree.best_move()
+        self.turns += 1
+        self.clock.charge(time.process_time() - start + self._worker_time()
+            - worker_start)
+        return move_to_action(move)
+
+    def update(self, colour, action):
+        start = time.process_time()
+        move = action_to_move(action)
+        self.game.make_move(move)
+        self.tree.advance(move)
+        self.clock.charge(time.process_time() - start)
+
+    def _worker_time(self):
+        """The CPU time (s) the workers have spent on playouts so far."""
+        return self.pool.cpu if self.pool else 0.0
+
+    def _think(self, elapsed, limit):
+        """
+        Grow the tree by batches of playouts until `elapsed()` (the CPU time
+        used this turn, by the player and its workers) passes `limit`.
+        """
+        self.tree.expand(self.tree.root, self.game)
+        pending = None
+        while True:
+            # select the next batch while the workers play out the last one
+            nbatch = _TASKS_PER_WORKER * len(self.pool) if self.pool else 1
+            batch = [self._select() for _ in range(nbatch)]
+            tasks = [self._task(leaf) for path, leaf in batch if leaf]
+            if pending is not None:
+                self._backpropagate(pending, self.pool.collect())
+                pending = None
+            if self.pool:
+                self.pool.submit(tasks)
+                pending = batch
+            else:
+                self._backpropagate(batch, list(map(_playouts, tasks)))
+            if elapsed() > limit:
+                break
+        if pending is not None:
+            self._backpropagate(pending, self.pool.collect())
+
+    def _select(self):
+        """
+        Select a path from the root to a leaf (expanding the leaf if it's due
+        and adding virtual loss along the way). Return the path and the state
+        at the leaf, or (for a finished game) the path and None, having
+        already backpropagated the game's result.
+        """
+        tree, game = self.tree, self.game
+        path = tree.select(game)
+        leaf = result = None
+        if game.over():
+            result = _result(game.board, game.score, drawn=bool(game.drawmsg))
+        else:
+            leaf = (game.board.pieces['r'], game.board.pieces['g'],
+                game.board.pieces['b'], game.score['r'], game.score['g'],
+                game.score['b'], game.nturns)
+        tree.unwind(game, path)
+        if result is not None:
+            tree.backpropagate(path, game.nturns,
+                [r * _PLAYOUTS_PER_TASK for r in result])
+        return path, leaf
+
+    def _task(self, leaf):
+        return leaf + (_PLAYOUTS_PER_TASK, self.rng.getrandbits(32))
+
+    def _backpropagate(self, batch, results):
+        results = iter(results)
+        root_turn = self.game.nturns
+        for path, leaf in batch:
+            if leaf is not None:
+                # (the turn at the root is the same as when it was selected)
+                self.tree.backpropagate(path, root_turn, next(results))
+                self.playouts += _PLAYOUTS_PER_TASK
+
+
+class _Tree:
+    """
+    A search tree, stored in arrays indexed by node number. The children of
+    a node are numbered consecutively from its first child. Each node keeps
+    its visit count and its total reward for the colour that moved into it.
+    """
+    def __init__(self):
+        self.first = array('i', [0])
+        self.nchildren = array('H', [0])
+        self.move = array('H', [0])
+        self.visits = array('I', [0])
+        self.reward = array('d', [0.0])
+        self.root = 0
+        self.tokens = [] # undo tokens for the moves made while selecting
+
+    def select(self, game):
+        """
+        Walk down the tree from the root by UCT, making each move on `game`,
+        and expand the leaf reached if it's due. Add virtual loss (a visit
+        with no reward yet) to each node on the path. Return the path.
+        """
+        node = self.root
+        path = [node]
+        visits, nchildren = self.visits, self.nchildren
+        while True:
+            visits[node] += _PLAYOUTS_PER_TASK
+            if not nchildren[node]:
+                if game.over() or visits[node] < _EXPAND_VISITS \
+                        * _PLAYOUTS_PER_TASK or not self.expand(node, game):
+                    return path
+            node = self._uct_child(node)
+            self.tokens.append(game.make_move(unpack_move(self.move[node])))
+            path.append(node)
+
+    def unwind(self, game, path):
+        """Unmake the moves made on `game` while selecting `path`."""
+        for _ in range(len(path) - 1):
+            game.unmake_move(self.tokens.pop())
+
+    def backpropagate(self, path, root_turn, result):
+        """
+        Add a result (total rewards for red, green and blue) to the nodes on
+        a path, each for the colour that moved into it.
+        """
+        reward = self.reward
+        for i, node in enumerate(path[1:]):
+            reward[node] += result[(root_turn + i) % 3]
+
+    def _uct_child(self, node):
+        first = self.first[node]
+        visits, reward = self.visits, self.reward
+        log_n = math.log(visits[node])
+        best, best_score = first, -1.0
+        for child in range(first, first + self.nchildren[node]):
+            n = visits[child]
+            if not n:
+                return child
+            score = reward[child] / n + _EXPLORATION * math.sqrt(log_n / n)
+            if score > best_score:
+                best, best_score = child, score
+        return best
+
+    def expand(self, node, game):
+        """
+        Add a node's children (if it has none yet and there's room), given
+        `game` in the node's position. Return True if it now has children.
+        """
+        if self.nchildren[node]:
+            return True
+        moves = game.moves()
+        first = len(self.first)
+        if first + len(moves) > MAX_NODES:
+            return False
+        n = len(moves)
+        self.first[node] = first
+        self.nchildren[node] = n
+        self.first.extend([0] * n)
+        self.nchildren.extend([0] * n)
+        self.move.extend(pack_move(move) for move in moves)
+        self.visits.extend([0] * n)
+        self.reward.extend([0.0] * n)
+        return True
+
+    def best_move(self):
+        """The root's most visited move."""
+        first = self.first[self.root]
+        children = range(first, first + self.nchildren[self.root])
+        best = max(children, key=self.visits.__getitem__)
+        return unpack_move(self.move[best])
+
+    def advance(self, move):
+        """
+        Make the root's child for a move (if there is one) the new root,
+        keeping only its subtree.
+        """
+        code, root = pack_move(move), self.root
+        first = self.first[root]
+        for child in range(first, first + self.nchildren[root]):
+            if self.move[child] == code:
+                self._reroot(child)
+                return
+        self.__init__()
+
+    def _reroot(self, root):
+        """Copy the subtree under a node into fresh arrays, as the tree."""
+        old = (self.first, self.nchildren, self.move, self.visits,
+            self.reward)
+        self.__init__()
+        self.move[0], self.visits[0], self.reward[0] = (old[2][root],
+            old[3][root], old[4][root])
+        # copy breadth first, so that children stay consecutive
+        queue = [(root, 0)]
+        for old_node, node in queue:
+            n = old[1][old_node]
+            if not n:
+                continue
+            old_first, first = old[0][old_node], len(self.first)
+            self.first[node], self.nchildren[node] = first, n
+            for field, old_field in zip(
+                    (self.first, self.nchildren, self.move, self.visits,
+                        self.reward), old):
+                field.extend(old_field[old_first:old_first+n])
+            queue.extend((old_first + i, first + i) for i in range(n))
+
+
+class _WorkerPool:
+    """
+    Playout worker processes, each forked from the player's process and
+    connected to it by a pipe. Each batch of tasks is split between the
+    workers, and then their results are collected in the same order, along
+    with the CPU time the workers took over them (totalled in `cpu`).
+
+    NOTE: This is deliberately simpler than a multiprocessing.Pool, which
+    runs helper threads in the player's process (each thread's stack and
+    memory arena would count towards the player's space usage), and which
+    can't start from a daemonic process (as the referee's --isolate mode
+    runs players in).
+    """
+    def __init__(self, n):
+        context = multiprocessing.get_context('fork')
+        self.conns = []
+        for _ in range(n):
+            conn, child_conn = context.Pipe()
+            pid = os.fork()
+            if pid == 0:
+                # in the worker process: serve tasks until the player's
+                # process goes away (or closes its end of the pipe)
+                conn.close()
+                for other in self.conns:
+                    other.close()
+                gc.freeze()
+                exitcode = 1
+                try:
+                    _work(child_conn)
+                    exitcode = 0
+                finally:
+                    os._exit(exitcode)
+            child_conn.close()
+            self.conns.append(conn)
+        self.chunks = []
+        self.cpu = 0.0
+    def __len__(self):
+        return len(self.conns)
+
+    def submit(self, tasks):
+        """Start a batch of tasks, split between the workers."""
+        n = len(self.conns)
+        self.chunks = [tasks[i::n] for i in range(n)]
+        for conn, chunk in zip(self.conns, self.chunks):
+            conn.send(chunk)
+    def collect(self):
+        """
+        Wait for the results of the last batch, in the order submitted. The
+        tasks of any worker that has died are played out here instead (and
+        the worker is dropped).
+        """
+        results = {}
+        conns = dict(zip(self.conns, self.chunks))
+        while conns:
+            for conn in wait(list(conns)):
+                chunk = conns.pop(conn)
+                try:
+                    results[id(chunk)], elapsed = conn.recv()
+                    self.cpu += elapsed
+                except (EOFError, OSError):
+                    self.conns.remove(conn)
+                    results[id(chunk)] = [_playouts(task) for task in chunk]
+        # put the results back together in the order of the tasks
+        chunks = [iter(results[id(chunk)]) for chunk in self.chunks]
+        ntasks = sum(len(chunk) for chunk in self.chunks)
+        return [next(chunks[i % len(chunks)]) for i in range(ntasks)]
+
+def _work(conn):
+    """Main loop of a playout worker process."""
+    while True:
+        try:
+            tasks = conn.recv()
+        except (EOFError, OSError):
+            return
+        start = time.process_time()
+        results = [_playouts(task) for task in tasks]
+        conn.send((results, time.process_time() - start))
+
+
+# Playouts (in the worker processes):
+
+class _Position:
+    """Just enough of a game for an Evaluator."""
+    def __init__(self, board, score):
+        self.board = board
+        self.score = score
+
+def _playouts(task):
+    """
+    Play out a number of games from a position at random (though favouring
+    exits, captures and forward steps), returning the total rewards for red,
+    green and blue.
+    """
+    *pieces, r, g, b, nturns, nplayouts, seed = task
+    rng = random.Random(seed)
+    total = [0.0, 0.0, 0.0]
+    for _ in range(nplayouts):
+        board = Bitboard(dict(zip(_COLOURS, pieces)))
+        score = {'r': r, 'g': g, 'b': b}
+        result = _playout(board, score, nturns, rng)
+        for i in range(3):
+            total[i] += result[i]
+    return total
+
+def _playout(board, score, nturns, rng):
+    """Play one game out on a board, returning the rewards (see _result)."""
+    limit = min(nturns + _PLAYOUT_TURNS, MAX_TURNS * 3)
+    while nturns < limit:
+        colour = _COLOURS[nturns % 3]
+        atype, a, b = _playout_move(board, colour, rng)
+        if atype == "MOVE":
+            board.move(colour, a, b)
+        elif atype == "JUMP":
+            board.jump(colour, a, b)
+        elif atype == "EXIT":
+            board.exit(colour, a)
+            score[colour] += 1
+            if score[colour] >= EXITS_TO_WIN:
+                break
+        nturns += 1
+    return _result(board, score, drawn=nturns >= MAX_TURNS * 3)
+
+def _playout_move(board, colour, rng):
+    exits = board.exits(colour)
+    if exits and rng.random() < 0.9:
+        return ("EXIT", rng.choice(exits), -1)
+    jumps, moves = board.jumps(colour), board.moves(colour)
+    pieces = board.pieces[colour]
+    captures = [(a, b) for a, b in jumps if not pieces >> JUMPED[a][b] & 1]
+    if captures and rng.random() < 0.5:
+        return ("JUMP",) + rng.choice(captures)
+    distance = DISTANCE[colour]
+    forward = [("JUMP", a, b) for a, b in jumps if distance[b] < distance[a]]
+    forward += [("MOVE", a, b) for a, b in moves if distance[b] < distance[a]]
+    if forward and rng.random() < 0.7:
+        return rng.choice(forward)
+    actions = [("EXIT", a, -1) for a in exits]
+    actions += [("JUMP", a, b) for a, b in jumps]
+    actions += [("MOVE", a, b) for a, b in moves]
+    return rng.choice(actions) if actions else ("PASS", -1, -1)
+
+def _result(board, score, drawn=False):
+    """
+    The rewards for red, green and blue of a finished (or stopped) game: 1
+    for the winner, or split between the colours with the best utility if no
+    colour has won, or split evenly for a draw.
+    """
+    if drawn:
+        return [1/3, 1/3, 1/3]
+    evaluator = Evaluator(_Position(board, score))
+    utilities = [evaluator.utility(colour) for colour in _COLOURS]
+    best = max(utilities)
+    leaders = utilities.count(best)
+    return [1/leaders if u == best else 0.0 for u in utilities]
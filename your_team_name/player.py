@@ -1,4 +1,22 @@
 
+import time
+
+from referee.game import Chexers, action_to_move, move_to_action
+from referee.symmetry import rotate_move
+from your_team_name.book import open_book
+from your_team_name.search import Search, TimeManager
+from your_team_name.ttable import TranspositionTable, position_key
+
+# the CPU time (s) this player allows itself for a whole game. This is well
+# within the referee's limit (-t, 60s by default: lower this to match a
+# lower limit), since the referee times each call from outside, and so also
+# charges the player for work the player doesn't time itself (garbage
+# collection during the call, and the referee's own work around it).
+TIME_BUDGET = 45.0
+# the memory (MB) for the search's transposition table (well within the
+# referee's default space limit of 100MB per player)
+TABLE_MEGABYTES = 32
+
 class ExamplePlayer:
     def __init__(self, colour):
         """
@@ -11,7 +29,19 @@ class ExamplePlayer:
         program will play as (Red, Green or Blue). The value will be one of the 
         strings "red", "green", or "blue" correspondingly.
         """
-        # TODO: Set up state representation.
+        start = time.process_time()
+        self.colour = colour[0]
+        # the game is kept up to date through update (without logging or
+        # validation), and the search makes and unmakes moves on it directly
+        # (both through the search, which keeps its evaluation up to date)
+        self.game = Chexers(None)
+        table = TranspositionTable(TABLE_MEGABYTES)
+        self.search = Search(self.game, self.colour, table)
+        self.clock = TimeManager(TIME_BUDGET)
+        self.turns = 0
+        # (if there's no opening book, we'll just search every position)
+        self.book = open_book()
+        self.clock.charge(time.process_time() - start)
 
 
     def action(self):
@@ -25,8 +55,14 @@ class ExamplePlayer:
         must be represented based on the above instructions for representing 
         actions.
         """
-        # TODO: Decide what action to take.
-        return ("PASS", None)
+        start = time.process_time()
+        move = self._book_move()
+        if move is None:
+            soft, hard = self.clock.allocate(self.turns)
+            move = self.search.best_move(start + soft, start + hard)
+        self.turns += 1
+        self.clock.charge(time.process_time() - start)
+        return move_to_action(move)
 
 
     def update(self, colour, action):
@@ -47,4 +83,36 @@ class ExamplePlayer:
         (or pass) for the player colour (your method does not need to validate 
         the action/pass against the game rules).
         """
-        # TODO: Update state representation in response to action.
+        start = time.process_time()
+        self.search.make_move(action_to_move(action))
+        self.clock.charge(time.process_time() - start)
+
+    def ponder(self, stop, charged):
+        """
+        Called by the referee (if it allows pondering) to think during the
+        other players' turns, until `stop` is set (see referee.player). The
+        search's work goes into its table, for when our turn comes.
+        """
+        start = time.thread_time()
+        deadline = float('inf')
+        if charged:
+            # (it comes out of our budget, so keep it to a share of a turn's)
+            soft, _ = self.clock.allocate(self.turns)
+            deadline = time.process_time() + soft / 2
+        self.search.ponder(stop, deadline)
+        if charged:
+            self.clock.charge(time.thread_time() - start)
+
+    def _book_move(self):
+        """The opening book's move for the current position, if it has one."""
+        if self.book is None:
+            return None
+        key, k = position_key(self.game, self.search.symmetric,
+            self.game.turn())
+        entry = self.book.lookup(key)
+        if entry is None:
+            return None
+        move, value = entry
+        move = rotate_move(move, -k % 3)
+        # (in case of a key collision, make sure the move is legal here)
+        return move if move in self.game.moves() else None
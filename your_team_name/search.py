@@ -0,0 +1,330 @@
+"""
+The player's search: iterative-deepening paranoid alpha-beta over a referee
+Chexers game (using its make/unmake API, so the game is never copied), with
+a transposition table, killer-move and history-heuristic move ordering, and a
+time manager to spread the player's CPU time budget over the rest of the game.
+"""
+
+import time
+import threading
+
+from referee.symmetry import SymmetricHash, rotate_move
+from your_team_name.evaluate import Evaluator, WIN
+from your_team_name.ttable import position_key, EXACT, LOWER, UPPER
+
+# the game is drawn after this many turns per player (see referee.game)
+MAX_TURNS = 256
+# (the deepest search to try, in plies, e.g. when there's no other choice)
+MAX_DEPTH = 64
+
+# check the clock every this many nodes (a power of two, less one)
+_CLOCK_MASK = 1023
+# move ordering bonuses (history heuristic scores add to these)
+_HASH_MOVE_BONUS = 1 << 50
+_KILLER_BONUS = 1 << 40
+_EXIT_BONUS = 1 << 30
+_JUMP_BONUS = 1 << 20
+
+# Values of won or lost positions depend on how many plies away from the root
+# they are, so the table stores them relative to the position instead
+def _to_table(value, ply):
+    if value >= WIN - MAX_DEPTH:
+        return value + ply
+    if value <= MAX_DEPTH - WIN:
+        return value - ply
+    return value
+def _from_table(value, ply):
+    if value >= WIN - MAX_DEPTH:
+        return value - ply
+    if value <= MAX_DEPTH - WIN:
+        return value + ply
+    return value
+
+class _OutOfTime(Exception):
+    """Raised within the search when it reaches its hard deadline."""
+
+class TimeManager:
+    """
+    Keep track of the CPU time a player has used out of its budget for the
+    game, and allocate each turn a share of what remains.
+
+    Each turn gets an equal share of the remaining budget over the expected
+    number of remaining turns (at most `horizon`, and never more than the
+    player can have before the game is drawn). Since each allocation comes
+    out of what remains, turns get less time as the game goes on, and the
+    player never runs out.
+    """
+    def __init__(self, budget, reserve=1.0, horizon=40):
+        self.budget = budget
+        self.reserve = reserve
+        self.horizon = horizon
+        self.used = 0.0
+
+    def charge(self, elapsed):
+        """Record that the player used `elapsed` seconds of CPU time."""
+        self.used += elapsed
+
+    def allocate(self, turns_taken):
+        """
+        The (soft, hard) time limits (s) for the player's next turn, after it
+        has taken `turns_taken` turns: the search should start no new
+        iteration after the soft limit, and stop altogether at the hard one.
+        """
+        remaining = max(self.budget - self.used - self.reserve, 0.0)
+        turns_left = max(1, min(MAX_TURNS - turns_taken, self.horizon))
+        soft = remaining / turns_left
+        hard = max(soft, min(4 * soft, remaining / 4))
+        return soft, hard
+
+
+class Search:
+    """
+    Choose actions for a colour by searching the game tree of `game` (a
+    referee Chexers game, kept up to date by the player).
+
+    The search is paranoid: it assumes that the other two colours play
+    together to minimise this colour's value (see evaluate), which makes the
+    game two-sided, so that alpha-beta pruning applies.
+
+    Results are stored in `table` (a TranspositionTable), so that positions
+    reached again (through another order of moves, or in a later iteration
+    or turn) needn't be searched again.
+
+    Positions are evaluated by `evaluator` (an Evaluator, by default a new
+    one for `game`), and keyed in the table through `symmetric` (a
+    SymmetricHash, likewise), which must both see every move made on the
+    game: the player should make its moves through make_move. Since keys
+    are canonical (see ttable.position_key), searches for different colours
+    can share a table (and these two as well).
+    """
+    def __init__(self, game, colour, table, evaluator=None, symmetric=None):
+        self.game = game
+        self.colour = colour
+        self.table = table
+        self.evaluator = evaluator or Evaluator(game)
+        self.symmetric = symmetric or SymmetricHash(game)
+        # killer moves: the (up to two) latest moves to cause a cutoff at
+        # each ply, for each colour
+        self.killers = [[] for _ in range(MAX_DEPTH + 1)]
+        # history heuristic: for each colour, how much each of its moves has
+        # caused cutoffs
+        self.history = {colour: {} for colour in "rgb"}
+        self._path = [] # undo tokens for the moves made by the search
+        self._deadline = 0.0
+        self._stop = threading.Event() # (never set, except when pondering)
+        self.nodes = 0
+        self.depth = 0
+
+    def best_move(self, soft, hard):
+        """
+        Search for the best move (see referee.game.Chexers.moves), deepening
+        until the soft deadline (a time.process_time value) has passed, or
+        interrupting the search at the hard deadline.
+        """
+        moves = self.game.moves()
+        if len(moves) == 1:
+            return moves[0]
+        self._deadline = hard
+        self.nodes = 0
+        self._age()
+        self.table.new_search()
+        best = moves[0]
+        for depth in range(1, MAX_DEPTH + 1):
+            try:
+                moves, value = self._root(moves, depth)
+            except _OutOfTime:
+                while self._path:
+                    self._unmake()
+                break
+            best, self.depth = moves[0], depth
+            if abs(value) >= WIN - MAX_DEPTH or time.process_time() > soft:
+                break
+        return best
+
+    def analyse(self, depth):
+        """
+        Search to a fixed depth, with no time limit (e.g. offline, to build
+        an opening book). Return all of the moves, best first, and the best
+        value.
+        """
+        self._deadline = float('inf')
+        self._age()
+        self.table.new_search()
+        moves = self.game.moves()
+        for d in range(1, depth + 1):
+            moves, value = self._root(moves, d)
+        return moves, value
+
+    def ponder(self, stop, deadline=float('inf')):
+        """
+        Search the current position (on another colour's turn), deepening
+        until `stop` (a threading.Event) is set, or the deadline (a
+        time.process_time value) has passed. The table keeps the results,
+        so when the player's turn comes, its search finds the positions
+        after the replies the other colours were predicted to play (those the
+        search looked at most deeply) already searched: a reply it didn't
+        predict just leaves its results unused, to be replaced in time.
+        """
+        self._deadline = deadline
+        self._stop = stop
+        # (not aging the killers and history: a turn can have many rounds
+        # of pondering, so they're aged only when the player's own search
+        # starts, once a turn)
+        self.table.new_search()
+        try:
+            for depth in range(1, MAX_DEPTH + 1):
+                value = self._search(depth, 0, -WIN * 2, WIN * 2)
+                if abs(value) >= WIN - MAX_DEPTH:
+                    break
+        except _OutOfTime:
+            while self._path:
+                self._unmake()
+        finally:
+            self._stop = threading.Event()
+
+    def _root(self, moves, depth):
+        """
+        Search each of the root moves (the best from the last iteration
+        first) to this depth. Return the moves reordered best first, and the
+        best value.
+        """
+        alpha, beta = -WIN * 2, WIN * 2
+        values = {}
+        for move in moves:
+            self._make(move)
+            values[move] = self._search(depth - 1, 1, alpha, beta)
+            self._unmake()
+            alpha = max(alpha, values[move])
+        moves = sorted(moves, key=values.get, reverse=True)
+        return moves, values[moves[0]]
+
+    def _search(self, depth, ply, alpha, beta):
+        """The paranoid value of the current position, searched to depth."""
+        game = self.game
+        self.nodes += 1
+        if not self.nodes & _CLOCK_MASK:
+            if time.process_time() > self._deadline or self._stop.is_set():
+                raise _OutOfTime()
+        if game.over():
+            return self._terminal(ply)
+        if depth == 0:
+            return self.evaluator.evaluate(self.colour)
+
+        # look for an earlier result for this position: it may settle the
+        # value here, and otherwise its best move is worth trying first
+        key, k = position_key(game, self.symmetric, self.colour)
+        entry = self.table.probe(key)
+        hash_move = None
+        if entry is not None:
+            entry_depth, bound, value, hash_move = entry
+            if hash_move is not None:
+                hash_move = rotate_move(hash_move, -k % 3)
+            if entry_depth >= depth:
+                value = _from_table(value, ply)
+                if bound == EXACT or (bound == LOWER and value >= beta) \
+                        or (bound == UPPER and value <= alpha):
+                    return value
+
+        turn = game.turn()
+        maximising = turn == self.colour
+        best = -WIN * 2 if maximising else WIN * 2
+        best_move = None
+        alpha0, beta0 = alpha, beta
+        for move in self._ordered(game.moves(), turn, ply, hash_move):
+            self._make(move)
+            value = self._search(depth - 1, ply + 1, alpha, beta)
+            self._unmake()
+            if maximising:
+                if value > best:
+                    best, best_move = value, move
+                alpha = max(alpha, best)
+            else:
+                if value < best:
+                    best, best_move = value, move
+                beta = min(beta, best)
+            if alpha >= beta:
+                self._cutoff(move, turn, ply, depth)
+                break
+
+        # (the search is fail-soft, so whatever the node, a value outside the
+        # original window is a bound on the true value, on that side)
+        if best <= alpha0:
+            bound = UPPER
+        elif best >= beta0:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if best_move is not None:
+            best_move = rotate_move(best_move, k)
+        self.table.store(key, depth, bound, _to_table(best, ply), best_move)
+        return best
+
+    def _terminal(self, ply):
+        """The value of a finished game (preferring quicker wins)."""
+        game = self.game
+        if game.drawmsg:
+            return 0
+        if game.score[self.colour] >= max(game.score.values()):
+            return WIN - ply
+        return ply - WIN
+
+    def make_move(self, move):
+        """
+        Make a move on the game (keeping the evaluator up to date), returning
+        its undo token.
+        """
+        token = self.game.make_move(move)
+        self.evaluator.make(token)
+        self.symmetric.make(token)
+        return token
+    def unmake_move(self, token):
+        """Unmake the last move made through make_move."""
+        self.game.unmake_move(token)
+        self.evaluator.unmake(token)
+        self.symmetric.unmake(token)
+
+    def _make(self, move):
+        self._path.append(self.make_move(move))
+    def _unmake(self):
+        self.unmake_move(self._path.pop())
+
+    # move ordering:
+
+    def _ordered(self, moves, turn, ply, hash_move=None):
+        """Sort moves for a colour at a ply, most promising first."""
+        killers = self.killers[ply]
+        history = self.history[turn]
+        def key(move):
+            score = history.get(move, 0)
+            if move == hash_move:
+                score += _HASH_MOVE_BONUS
+            if move in killers:
+                score += _KILLER_BONUS
+            if move[0] == "EXIT":
+                score += _EXIT_BONUS
+            elif move[0] == "JUMP":
+                score += _JUMP_BONUS
+            return score
+        moves.sort(key=key, reverse=True)
+        return moves
+
+    def _cutoff(self, move, turn, ply, depth):
+        """Remember a move that caused a cutoff, for ordering moves later."""
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        history = self.history[turn]
+        history[move] = history.get(move, 0) + depth * depth
+
+    def _age(self):
+        """
+        Between turns (when a real search starts, not when pondering),
+        forget the killer moves (their plies no longer line up) and weaken
+        the history scores (they gradually go out of date).
+        """
+        for killers in self.killers:
+            killers.clear()
+        for history in self.history.values():
+            for move in history:
+                history[move] >>= 2
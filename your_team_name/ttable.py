@@ -0,0 +1,105 @@
+"""
+A transposition table for the player's search: a fixed-size hash table of
+search results, keyed by 64-bit position hash, stored in flat arrays (rather
+than a dict of tuples) so that its memory use is small and known up front.
+"""
+
+import random
+from array import array
+
+from referee.game import pack_move, unpack_move
+from referee.symmetry import ROTATE_COLOUR
+from your_team_name.evaluate import EXITS_TO_WIN
+
+# bound types: whether a stored value is exact, or a lower or upper bound
+EXACT, LOWER, UPPER = 1, 2, 3
+
+# the size of one entry (bytes): key, value, depth, bound, move and age
+ENTRY_SIZE = 8 + 4 + 1 + 1 + 2 + 1
+
+# moves are stored packed (see referee.game.pack_move), or as this for none
+_NO_MOVE = 0xFFFF
+
+# Keys are the hash of the canonical rotation of a position (in which it's
+# red's turn: see referee.symmetry), so that all three rotations of a position
+# share an entry. That hash covers the pieces on the board and whose turn it
+# is, so the key mixes in a key for each colour's score too, and one for the
+# 'seat' of the colour the entry is for (that colour's place in the turn
+# order, relative to the colour whose turn it is). The keys come from a fixed
+# seed, like the board's.
+_rng = random.Random(0x5C03E5)
+SCORE_KEYS = {colour: [_rng.getrandbits(64) for _ in range(EXITS_TO_WIN+1)]
+    for colour in "rgb"}
+SEAT_KEYS = [0, _rng.getrandbits(64), _rng.getrandbits(64)]
+del _rng
+
+def position_key(game, symmetric, colour):
+    """
+    The transposition table key of a (referee Chexers) game's position, for
+    a colour, given a SymmetricHash for the game. Return the key and the
+    number of rotations from the position to the canonical one (rotate moves
+    by that number to store them, and back to look them up).
+    """
+    h, k = symmetric.canonical()
+    score, keys, colours = game.score, SCORE_KEYS, ROTATE_COLOUR[k]
+    seat = ("rgb".index(colour) - "rgb".index(game.turn())) % 3
+    return (h ^ SEAT_KEYS[seat] ^ keys[colours['r']][score['r']]
+        ^ keys[colours['g']][score['g']] ^ keys[colours['b']][score['b']]), k
+
+
+class TranspositionTable:
+    """
+    A table of search results for up to `megabytes` of memory (rounded down
+    to a power of two number of buckets).
+
+    Each bucket has two entries: one 'depth-preferred', replaced only by a
+    result searched at least as deep (or left over from an earlier search),
+    and one 'always-replace', which takes any result the first one won't.
+    Deep results (the most expensive to recompute) therefore survive, while
+    recent shallow ones still get stored.
+    """
+    def __init__(self, megabytes=32):
+        nbuckets = 1
+        while 4 * nbuckets * ENTRY_SIZE <= megabytes * 2**20:
+            nbuckets *= 2
+        self.mask = nbuckets - 1
+        n = 2 * nbuckets
+        self.keys   = array('Q', [0]) * n
+        self.values = array('i', [0]) * n
+        self.depths = array('b', [0]) * n
+        self.bounds = array('B', [0]) * n
+        self.moves  = array('H', [_NO_MOVE]) * n
+        self.ages   = array('B', [0]) * n
+        self.age = 0
+
+    def new_search(self):
+        """Mark entries stored so far as old (so they are replaced first)."""
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key):
+        """
+        Look up a position's entry, returning (depth, bound, value, move), or
+        None if it has none. The move is None if no best move was stored.
+        """
+        i = (key & self.mask) << 1
+        keys = self.keys
+        if keys[i] != key:
+            i += 1
+            if keys[i] != key:
+                return None
+        code = self.moves[i]
+        move = None if code == _NO_MOVE else unpack_move(code)
+        return self.depths[i], self.bounds[i], self.values[i], move
+
+    def store(self, key, depth, bound, value, move):
+        """Store a search result for a position (move may be None)."""
+        i = (key & self.mask) << 1
+        if not (self.keys[i] == key or depth >= self.depths[i]
+                or self.ages[i] != self.age):
+            i += 1
+        self.keys[i] = key
+        self.values[i] = value
+        self.depths[i] = depth
+        self.bounds[i] = bound
+        self.moves[i] = _NO_MOVE if move is None else pack_move(move)
+        self.ages[i] = self.age